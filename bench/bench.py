@@ -0,0 +1,258 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import click
+from rich.console import Console
+from rich.table import Table
+
+import lndgrpcclient
+from clnclient import ClnClient
+from clnsocketclient import ClnSocketClient
+from feepolicy import FeePolicy
+from lndcliclient import LndCliClient
+from lndgrpcclient import LndGrpcClient
+from lndrestclient import LndRestClient
+from suez import channel_table
+from terminal_web import TerminalWeb
+
+CLIENTS = {
+    "lnd": LndCliClient,
+    "lnd-rest": LndRestClient,
+    "lnd-grpc": LndGrpcClient,
+    "c-lightning": ClnClient,
+    "c-lightning-socket": ClnSocketClient,
+}
+
+# lnd-grpc needs grpcio and the generated stubs, it is only run by default
+# when they are there
+DEFAULT_BACKENDS = tuple(
+    b for b in CLIENTS if b != "lnd-grpc" or lndgrpcclient.grpc is not None
+)
+
+# skewed by the balance of each channel, so nearly every channel changes
+POLICY = FeePolicy(1000, 200, 1.5, 40)
+
+TABLE_OPTIONS = dict(
+    show_remote_fees=True,
+    show_chan_ids=True,
+    show_forwarding_stats=True,
+    show_minmax_htlc=True,
+    show_disabled=True,
+)
+
+
+@contextlib.contextmanager
+def serve(script, *args):
+    # the fake node runs in its own process, so serving requests does not
+    # count against the client's time or memory; it prints where it listens
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, script), *args],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextlib.contextmanager
+def rest_server():
+    with serve("restserver.py", "0") as port, tempfile.TemporaryDirectory() as tmp:
+        macaroon = os.path.join(tmp, "bench.macaroon")
+        with open(macaroon, "wb") as f:
+            f.write(b"bench")
+        yield (f"rpcserver=http://127.0.0.1:{port}", f"macaroonpath={macaroon}")
+
+
+@contextlib.contextmanager
+def grpc_server():
+    # grpc only talks TLS; an ECDSA certificate like the one lnd makes
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = os.path.join(tmp, "tls.cert"), os.path.join(tmp, "tls.key")
+        subprocess.run(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                "-newkey",
+                "ec",
+                "-pkeyopt",
+                "ec_paramgen_curve:prime256v1",
+                "-nodes",
+                "-days",
+                "1",
+                "-subj",
+                "/CN=localhost",
+                "-addext",
+                "subjectAltName=IP:127.0.0.1",
+                "-keyout",
+                key,
+                "-out",
+                cert,
+            ],
+            check=True,
+            capture_output=True,
+        )
+        macaroon = os.path.join(tmp, "bench.macaroon")
+        with open(macaroon, "wb") as f:
+            f.write(b"bench")
+        with serve("grpcserver.py", "0", cert, key) as port:
+            yield (
+                f"rpcserver=127.0.0.1:{port}",
+                f"macaroonpath={macaroon}",
+                f"tlscertpath={cert}",
+            )
+
+
+@contextlib.contextmanager
+def socket_server():
+    with tempfile.TemporaryDirectory() as tmp:
+        rpcfile = os.path.join(tmp, "lightning-rpc")
+        with serve("clnsocketserver.py", rpcfile):
+            yield (f"rpc-file={rpcfile}",)
+
+
+SERVERS = {
+    "lnd-rest": rest_server,
+    "lnd-grpc": grpc_server,
+    "c-lightning-socket": socket_server,
+}
+
+
+def measure(fn, memory):
+    """
+    returns (result, seconds, peak traced bytes or None) of calling fn
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+        return (
+            result,
+            time.perf_counter() - start,
+            (tracemalloc.get_traced_memory()[1] if memory else None),
+        )
+    finally:
+        if memory:
+            tracemalloc.stop()
+
+
+def rpcs(ln):
+    return sum(ln.rpc_stats.counts().values())
+
+
+def run(backend, channels, forwards, bulk_graph, jobs, memory):
+    """
+    yields one result per stage for a node with the given size
+    """
+    os.environ["SUEZ_BENCH_CHANNELS"] = str(channels)
+    os.environ["SUEZ_BENCH_FORWARDS"] = str(forwards)
+    result = dict(backend=backend, channels=channels, forwards=forwards)
+
+    server = SERVERS.get(backend, lambda: contextlib.nullcontext(()))
+    with server() as args:
+        ln, seconds, peak = measure(
+            lambda: CLIENTS[backend](list(args), bulk_graph=bulk_graph, jobs=jobs),
+            memory,
+        )
+        yield dict(result, stage="refresh", seconds=seconds, rpcs=rpcs(ln), peak=peak)
+
+        before = rpcs(ln)
+        _, seconds, peak = measure(lambda: ln.apply_fee_policy(POLICY), memory)
+        yield dict(
+            result,
+            stage="apply_fee_policy",
+            seconds=seconds,
+            rpcs=rpcs(ln) - before,
+            peak=peak,
+        )
+
+    terminal_web = TerminalWeb(ln.local_pubkey, False, False)
+    console = Console(file=io.StringIO(), width=200)
+    _, seconds, peak = measure(
+        lambda: console.print(
+            channel_table(list(ln.channels.values()), terminal_web, **TABLE_OPTIONS)
+        ),
+        memory,
+    )
+    yield dict(result, stage="channel_table", seconds=seconds, rpcs=0, peak=peak)
+
+
+@click.command()
+@click.option(
+    "--backend",
+    "backends",
+    multiple=True,
+    type=click.Choice(tuple(CLIENTS), case_sensitive=False),
+    help="Backend to benchmark (default: all of them, lnd-grpc only when "
+    "its stubs are importable).",
+)
+@click.option(
+    "--channels",
+    "sizes",
+    default="10,100,1000",
+    help="Comma separated channel counts of the synthetic nodes.",
+)
+@click.option(
+    "--forwards", default=10000, help="Forwards of the synthetic nodes (last 30 days)."
+)
+@click.option("--bulk-graph", is_flag=True, help="Fetch channel graph in bulk.")
+@click.option("--jobs", type=int, default=None, help="Parallel per-channel lookups.")
+@click.option(
+    "--memory/--no-memory",
+    default=True,
+    help="Trace peak memory (slows the Python parts down).",
+)
+@click.option("--json", "as_json", is_flag=True, help="Print one JSON line per result.")
+def bench(backends, sizes, forwards, bulk_graph, jobs, memory, as_json):
+    """
+    times suez against synthetic nodes served by the fake lncli and
+    lightning-cli in bench/bin, fake lnd REST and gRPC servers and a fake
+    lightning-rpc socket
+    """
+    os.environ["PATH"] = (
+        os.path.join(BENCH_DIR, "bin") + os.pathsep + os.environ["PATH"]
+    )
+    # every fake answers for the same moment, wherever its forwards start
+    os.environ["SUEZ_BENCH_NOW"] = str(int(time.time()))
+
+    table = Table()
+    for name in ("backend", "channels", "forwards", "stage", "seconds", "rpcs", "peak"):
+        table.add_column(
+            name, justify="left" if name in ("backend", "stage") else "right"
+        )
+    console = Console()
+    for backend in backends or DEFAULT_BACKENDS:
+        for channels in (int(s) for s in sizes.split(",")):
+            for r in run(backend, channels, forwards, bulk_graph, jobs, memory):
+                if as_json:
+                    click.echo(json.dumps(r))
+                    continue
+                table.add_row(
+                    r["backend"],
+                    str(r["channels"]),
+                    str(r["forwards"]),
+                    r["stage"],
+                    f"{r['seconds']:.3f}",
+                    str(r["rpcs"]),
+                    "" if r["peak"] is None else f"{r['peak'] / 1000000:.1f} MB",
+                )
+    if not as_json:
+        console.print(table)
+
+
+if __name__ == "__main__":
+    bench()
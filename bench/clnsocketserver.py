@@ -0,0 +1,58 @@
+import json
+import os
+import socket
+import sys
+import threading
+
+from fakenode import FakeNode
+
+node = FakeNode()
+
+
+def handle(conn):
+    # requests may arrive pipelined and split anywhere, every response is
+    # terminated with a blank line like lightningd's
+    decoder = json.JSONDecoder()
+    buffer = ""
+    with conn:
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            buffer += data.decode()
+            while True:
+                buffer = buffer.lstrip()
+                try:
+                    request, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break
+                buffer = buffer[end:]
+                conn.sendall(json.dumps(reply(request)).encode() + b"\n\n")
+
+
+def reply(request):
+    # the fake takes lightning-cli's string arguments
+    params = request.get("params", [])
+    if isinstance(params, dict):
+        args, kwargs = [], {k: str(v) for k, v in params.items()}
+    else:
+        args, kwargs = [str(p) for p in params], {}
+    try:
+        result = node.cln(request["method"], *args, **kwargs)
+    except ValueError as e:
+        return {"jsonrpc": "2.0", "id": request["id"], "error": {"message": str(e)}}
+    return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+
+if __name__ == "__main__":
+    # usage: clnsocketserver.py PATH; PATH is printed once it is listening
+    path = sys.argv[1]
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    print(path, flush=True)
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
@@ -0,0 +1,291 @@
+import json
+import os
+import time
+
+LOCAL_PUBKEY = "02" + "aa" * 32
+
+# forwards are spread evenly over this many days before now
+FORWARD_DAYS = 30
+
+
+class FakeNode:
+    """
+    a deterministic synthetic node answering lncli and lightning-cli calls;
+    every channel, edge and forward is computed from its index on demand so
+    that huge nodes cost nothing until they are asked for
+    """
+
+    def __init__(self, channels=None, forwards=None, now=None):
+        self.channels = int(
+            os.environ.get("SUEZ_BENCH_CHANNELS", 100) if channels is None else channels
+        )
+        self.forwards = int(
+            os.environ.get("SUEZ_BENCH_FORWARDS", 1000)
+            if forwards is None
+            else forwards
+        )
+        now = int(os.environ.get("SUEZ_BENCH_NOW", time.time()) if now is None else now)
+        self.now = now // 86400 * 86400
+        self.spacing = FORWARD_DAYS * 86400 / max(self.forwards, 1)
+
+    # channels are numbered 1 .. self.channels
+
+    @staticmethod
+    def peer(i):
+        return "03" + "%064x" % i
+
+    @staticmethod
+    def chan_id(i):
+        return str(800000 << 40 | i << 16)
+
+    @staticmethod
+    def scid(i):
+        return "800000x%dx0" % i
+
+    @staticmethod
+    def txid(i):
+        return "%064x" % i
+
+    @staticmethod
+    def capacity(i):
+        return 1000000 + (i * 7919) % 9000000
+
+    def local_balance(self, i):
+        return (i * 104729) % (self.capacity(i) - 1000)
+
+    def index(self, chan):
+        # channel number from a chan_id, scid or pubkey
+        if "x" in chan:
+            return int(chan.split("x")[1])
+        if len(chan) == 66:
+            return int(chan[2:], 16)
+        return (int(chan) >> 16) & 0xFFFFFF
+
+    def forward(self, k):
+        # (timestamp, incoming channel, outgoing channel, amt_in_msat, fee_msat)
+        ts = self.now - (self.forwards - k) * self.spacing
+        cin = 1 + (k * 31) % self.channels
+        cout = 1 + (k * 17 + 1) % self.channels
+        if cout == cin:
+            cout = 1 + cin % self.channels
+        amt_in_msat = 10000000 + (k * 9973) % 990000000
+        return ts, cin, cout, amt_in_msat, 1000 + amt_in_msat // 2000
+
+    def first_forward(self, since):
+        # index of the first forward at or after since
+        k = int(self.forwards - (self.now - since) / self.spacing)
+        k = min(max(k, 0), self.forwards)
+        while k > 0 and self.forward(k - 1)[0] >= since:
+            k -= 1
+        while k < self.forwards and self.forward(k)[0] < since:
+            k += 1
+        return k
+
+    # lnd
+
+    def lnd_policy(self, i, local):
+        return {
+            "time_lock_delta": 40,
+            "min_htlc": "1000",
+            "fee_base_msat": "1000" if local else str(i % 3 * 500),
+            "fee_rate_milli_msat": str(100 + i % 400) if local else str(i % 1000),
+            "disabled": i % 50 == 0 and not local,
+            "max_htlc_msat": str(self.capacity(i) * 990),
+        }
+
+    def lnd_channel(self, i):
+        local = self.local_balance(i)
+        return {
+            "chan_id": self.chan_id(i),
+            "active": i % 20 != 0,
+            "private": i % 10 == 0,
+            "initiator": i % 2 == 0,
+            "remote_pubkey": self.peer(i),
+            "channel_point": self.txid(i) + ":0",
+            "uptime": str(90000 - i % 9000),
+            "lifetime": "90000",
+            "capacity": str(self.capacity(i)),
+            "commit_fee": "1000",
+            "local_balance": str(local),
+            "remote_balance": str(self.capacity(i) - 1000 - local),
+        }
+
+    def lnd_edge(self, i):
+        return {
+            "channel_id": self.chan_id(i),
+            "chan_point": self.txid(i) + ":0",
+            "node1_pub": LOCAL_PUBKEY,
+            "node2_pub": self.peer(i),
+            "node1_policy": self.lnd_policy(i, True),
+            "node2_policy": self.lnd_policy(i, False),
+        }
+
+    def lnd_node(self, i):
+        return {"pub_key": self.peer(i), "alias": "peer-%d" % i}
+
+    def lnd(self, method, *args, **kwargs):
+        n = range(1, self.channels + 1)
+        if method == "getinfo":
+            return {"identity_pubkey": LOCAL_PUBKEY, "alias": "bench"}
+        if method == "listchannels":
+            return {"channels": [self.lnd_channel(i) for i in n]}
+        if method == "getchaninfo":
+            return self.lnd_edge(self.index(args[0]))
+        if method == "getnodeinfo":
+            return {"node": self.lnd_node(self.index(args[0]))}
+        if method == "describegraph":
+            return {
+                "nodes": [self.lnd_node(i) for i in n],
+                "edges": [self.lnd_edge(i) for i in n],
+            }
+        if method == "fwdinghistory":
+            start = self.first_forward(int(kwargs.get("start_time", 0)))
+            offset = int(kwargs.get("index_offset", 0))
+            first = start + offset
+            last = min(first + int(kwargs.get("max_events", 100)), self.forwards)
+            events = []
+            for k in range(first, last):
+                ts, cin, cout, amt_in_msat, fee_msat = self.forward(k)
+                events.append(
+                    {
+                        "chan_id_in": self.chan_id(cin),
+                        "chan_id_out": self.chan_id(cout),
+                        "timestamp": str(int(ts)),
+                        "timestamp_ns": str(int(ts * 1000000000)),
+                        "fee_msat": str(fee_msat),
+                        "amt_in": str(amt_in_msat // 1000),
+                        "amt_in_msat": str(amt_in_msat),
+                        "amt_out": str((amt_in_msat - fee_msat) // 1000),
+                    }
+                )
+            return {
+                "forwarding_events": events,
+                "last_offset_index": offset + len(events),
+            }
+        if method == "updatechanpolicy":
+            return {"failed_updates": []}
+        raise ValueError(f"unknown lnd method {method}")
+
+    # core lightning
+
+    def cln_peer_channel(self, i):
+        local = self.local_balance(i)
+        return {
+            "peer_id": self.peer(i),
+            "short_channel_id": self.scid(i),
+            "state": "CHANNELD_NORMAL" if i % 20 != 0 else "CHANNELD_AWAITING_LOCKIN",
+            "opener": "local" if i % 2 == 0 else "remote",
+            "private": i % 10 == 0,
+            "channel_id": self.txid(i),
+            "total_msat": self.capacity(i) * 1000,
+            "to_us_msat": local * 1000,
+            "last_tx_fee_msat": "1000000msat",
+            "in_payments_offered": 2 * i,
+            "in_payments_fulfilled": i,
+            "out_payments_offered": i,
+            "out_payments_fulfilled": i // 2,
+        }
+
+    def cln_channel(self, i, local):
+        policy = self.lnd_policy(i, local)
+        return {
+            "short_channel_id": self.scid(i),
+            "source": LOCAL_PUBKEY if local else self.peer(i),
+            "destination": self.peer(i) if local else LOCAL_PUBKEY,
+            "base_fee_millisatoshi": int(policy["fee_base_msat"]),
+            "fee_per_millionth": int(policy["fee_rate_milli_msat"]),
+            "htlc_minimum_msat": 1000,
+            "htlc_maximum_msat": int(policy["max_htlc_msat"]),
+            "active": not policy["disabled"],
+            "delay": 40,
+        }
+
+    def cln_forward(self, k):
+        ts, cin, cout, amt_in_msat, fee_msat = self.forward(k)
+        return {
+            "in_channel": self.scid(cin),
+            "out_channel": self.scid(cout),
+            "in_msat": amt_in_msat,
+            "out_msat": amt_in_msat - fee_msat,
+            "fee_msat": fee_msat,
+            "status": "settled",
+            "received_time": ts - 1.5,
+            "resolved_time": ts,
+            "created_index": k + 1,
+            "updated_index": k + 1,
+        }
+
+    def cln(self, method, *args, **kwargs):
+        n = range(1, self.channels + 1)
+        if method == "getinfo":
+            return {"id": LOCAL_PUBKEY, "alias": "bench"}
+        if method == "listpeers":
+            return {"peers": [{"id": self.peer(i), "num_channels": 1} for i in n]}
+        if method == "listpeerchannels":
+            if args:
+                return {"channels": [self.cln_peer_channel(self.index(args[0]))]}
+            return {"channels": [self.cln_peer_channel(i) for i in n]}
+        if method == "listchannels":
+            if "source" in kwargs:
+                return {"channels": [self.cln_channel(i, True) for i in n]}
+            if "destination" in kwargs:
+                return {"channels": [self.cln_channel(i, False) for i in n]}
+            i = self.index(args[0])
+            return {"channels": [self.cln_channel(i, True), self.cln_channel(i, False)]}
+        if method == "listnodes":
+            if args:
+                i = self.index(args[0])
+                return {"nodes": [{"nodeid": self.peer(i), "alias": "peer-%d" % i}]}
+            return {
+                "nodes": [{"nodeid": self.peer(i), "alias": "peer-%d" % i} for i in n]
+            }
+        if method == "listforwards":
+            start = max(int(kwargs.get("start", 1)), 1) - 1
+            last = min(start + int(kwargs.get("limit", self.forwards)), self.forwards)
+            return {"forwards": [self.cln_forward(k) for k in range(start, last)]}
+        if method == "setchannel":
+            ids = [self.scid(i) for i in n] if args[0] == "all" else [args[0]]
+            return {
+                "channels": [
+                    {
+                        "short_channel_id": scid,
+                        "fee_base_msat": int(args[1]),
+                        "fee_proportional_millionths": int(args[2]),
+                    }
+                    for scid in ids
+                ]
+            }
+        raise ValueError(f"unknown lightning-cli method {method}")
+
+
+def parse_argv(argv):
+    """
+    splits an lncli or lightning-cli command line into (method, args, kwargs);
+    "--name value", "--flag" and "name=value" all become keyword arguments
+    """
+    argv = list(argv)
+    # global options such as --rpcserver=... come before the method
+    while argv and argv[0].startswith("-"):
+        argv.pop(0)
+    method, rest = argv[0], argv[1:]
+    args = []
+    kwargs = {}
+    while rest:
+        a = rest.pop(0)
+        if a.startswith("--"):
+            name, sep, value = a[2:].partition("=")
+            if not sep:
+                value = rest.pop(0) if rest and not rest[0].startswith("--") else True
+            kwargs[name] = value
+        elif "=" in a:
+            name, value = a.split("=", 1)
+            kwargs[name] = value
+        else:
+            args.append(a)
+    return method, args, kwargs
+
+
+def main(kind, argv):
+    method, args, kwargs = parse_argv(argv)
+    node = FakeNode()
+    print(json.dumps(getattr(node, kind)(method, *args, **kwargs)))
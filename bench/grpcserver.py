@@ -0,0 +1,64 @@
+import os
+import sys
+from concurrent import futures
+
+# the generated lightning_pb2 modules live next to suez (or on PYTHONPATH)
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import grpc
+import lightning_pb2 as ln
+import lightning_pb2_grpc as lnrpc
+from google.protobuf import json_format
+
+from fakenode import FakeNode
+
+node = FakeNode()
+
+
+def message(response, cls):
+    # the fake answers with lncli's JSON, which is the protobuf JSON mapping
+    return json_format.ParseDict(response, cls(), ignore_unknown_fields=True)
+
+
+class Lightning(lnrpc.LightningServicer):
+    def GetInfo(self, request, context):
+        return message(node.lnd("getinfo"), ln.GetInfoResponse)
+
+    def ListChannels(self, request, context):
+        return message(node.lnd("listchannels"), ln.ListChannelsResponse)
+
+    def GetChanInfo(self, request, context):
+        return message(node.lnd("getchaninfo", str(request.chan_id)), ln.ChannelEdge)
+
+    def GetNodeInfo(self, request, context):
+        return message(node.lnd("getnodeinfo", request.pub_key), ln.NodeInfo)
+
+    def DescribeGraph(self, request, context):
+        return message(node.lnd("describegraph"), ln.ChannelGraph)
+
+    def ForwardingHistory(self, request, context):
+        return message(
+            node.lnd(
+                "fwdinghistory",
+                start_time=request.start_time,
+                index_offset=request.index_offset,
+                max_events=request.num_max_events,
+            ),
+            ln.ForwardingHistoryResponse,
+        )
+
+    def UpdateChannelPolicy(self, request, context):
+        return message(node.lnd("updatechanpolicy"), ln.PolicyUpdateResponse)
+
+
+if __name__ == "__main__":
+    # usage: grpcserver.py PORT TLS_CERT TLS_KEY; port 0 picks a free port,
+    # the one in use is printed for the harness
+    port, cert, key = sys.argv[1:4]
+    with open(key, "rb") as k, open(cert, "rb") as c:
+        credentials = grpc.ssl_server_credentials([(k.read(), c.read())])
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    lnrpc.add_LightningServicer_to_server(Lightning(), server)
+    print(server.add_secure_port(f"127.0.0.1:{port}", credentials), flush=True)
+    server.start()
+    server.wait_for_termination()
@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from fakenode import FakeNode
+
+node = FakeNode()
+
+# lnd's streams as recorded from its REST API, one {"result": ...} per line
+EVENTS_DIR = os.environ.get(
+    "SUEZ_BENCH_EVENTS", os.path.join(os.path.dirname(__file__), "events")
+)
+
+# seconds between two replayed events
+EVENT_INTERVAL = 1
+
+STREAMS = {
+    ("channels", "subscribe"): "channels.jsonl",
+    ("router", "htlcevents"): "htlc.jsonl",
+    ("graph", "subscribe"): "graph.jsonl",
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    # keep-alive, like lnd, so the client's connection pool gets reused
+    protocol_version = "HTTP/1.1"
+    # headers and body go out as separate writes, without this every reply
+    # waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        path = urlparse(self.path).path.strip("/").split("/")[1:]
+        if tuple(path) in STREAMS:
+            self.stream(STREAMS[tuple(path)])
+        elif path[:2] == ["graph", "edge"]:
+            self.reply(node.lnd("getchaninfo", path[2]))
+        elif path[:2] == ["graph", "node"]:
+            self.reply(node.lnd("getnodeinfo", path[2]))
+        elif path == ["graph"]:
+            self.reply(node.lnd("describegraph"))
+        elif path == ["channels"]:
+            self.reply(node.lnd("listchannels"))
+        elif path == ["getinfo"]:
+            self.reply(node.lnd("getinfo"))
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path.strip("/").split("/")[1:]
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if path == ["switch"]:
+            self.reply(
+                node.lnd(
+                    "fwdinghistory",
+                    start_time=body.get("start_time", 0),
+                    index_offset=body.get("index_offset", 0),
+                    max_events=body.get("num_max_events", 100),
+                )
+            )
+        elif path == ["chanpolicy"]:
+            self.reply(node.lnd("updatechanpolicy"))
+        else:
+            self.send_error(404)
+
+    def reply(self, response):
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, name):
+        # the recorded events are sent as if they just happened, one chunk
+        # each like lnd does, then the stream stays open and quiet
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        with open(os.path.join(EVENTS_DIR, name)) as f:
+            for line in f:
+                time.sleep(EVENT_INTERVAL)
+                message = json.loads(line)
+                if "timestamp_ns" in message["result"]:
+                    message["result"]["timestamp_ns"] = str(time.time_ns())
+                chunk = json.dumps(message).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+        while True:
+            time.sleep(3600)
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    # port 0 picks a free port, the one in use is printed for the harness
+    server = ThreadingHTTPServer(("127.0.0.1", int(sys.argv[1])), Handler)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
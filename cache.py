@@ -0,0 +1,82 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# how long each kind of entry stays valid, in seconds
+TTLS = {
+    "alias": 7 * 86400,
+    "chaninfo": 600,
+    "terminal": 3600,
+}
+
+MAX_ENTRIES = 100000
+
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "suez"
+
+
+class Cache:
+    def __init__(
+        self, backend, path=None, refresh=False, max_entries=MAX_ENTRIES, bypass=()
+    ):
+        self.backend = backend
+        self.refresh = refresh
+        # kinds that are always fetched anew (and still stored for later runs)
+        self.bypass = frozenset(bypass)
+        self.max_entries = max_entries
+        if path is None:
+            cache_dir().mkdir(parents=True, exist_ok=True)
+            path = cache_dir() / "cache.sqlite"
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "backend TEXT, node TEXT, kind TEXT, key TEXT, value TEXT, "
+            "fetched_at REAL, PRIMARY KEY (backend, node, kind, key))"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_fetched_at ON entries (fetched_at)"
+        )
+
+    def fetch(self, node, kind, key, fn):
+        # read-through: return the stored value while it is fresh, otherwise
+        # call fn and remember its result
+        if not self.refresh and kind not in self.bypass:
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT value FROM entries WHERE backend = ? AND node = ? "
+                    "AND kind = ? AND key = ? AND fetched_at > ?",
+                    (self.backend, node, kind, key, time.time() - TTLS[kind]),
+                ).fetchone()
+            if row is not None:
+                return json.loads(row[0])
+        value = fn()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (self.backend, node, kind, key, json.dumps(value), time.time()),
+            )
+        return value
+
+    def invalidate(self, node, kind, key):
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM entries WHERE backend = ? AND node = ? "
+                "AND kind = ? AND key = ?",
+                (self.backend, node, kind, key),
+            )
+
+    def flush(self):
+        # drop the oldest entries once the cache grows over its limit
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries "
+                "ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.db.commit()
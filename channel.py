@@ -2,6 +2,7 @@ class Channel:
     """
     self.chan_id
     self.active
+    self.private
     self.channel_point
     self.local_node_id
     self.remote_node_id
@@ -13,11 +14,70 @@ class Channel:
     self.local_fee_rate
     self.remote_base_fee
     self.remote_fee_rate
+    self.local_time_lock_delta
+    self.local_min_htlc
+    self.local_max_htlc
+    self.remote_min_htlc
+    self.remote_max_htlc
+    self.local_disabled
+    self.remote_disabled
     self.local_alias
     self.remote_alias
     self.uptime
     self.lifetime
     self.last_forward
-    self.earned_fees
+    self.local_fees_msat
+    self.remote_fees
+    self.ins
+    self.ins_percent
+    self.outs
+    self.outs_percent
     self.opener
     """
+
+    # fixed attributes instead of a per-instance __dict__ keep thousands of
+    # channels small in memory
+    __slots__ = (
+        "chan_id",
+        "active",
+        "private",
+        "channel_point",
+        "local_node_id",
+        "remote_node_id",
+        "capacity",
+        "commit_fee",
+        "local_balance",
+        "remote_balance",
+        "local_base_fee",
+        "local_fee_rate",
+        "remote_base_fee",
+        "remote_fee_rate",
+        "local_time_lock_delta",
+        "local_min_htlc",
+        "local_max_htlc",
+        "remote_min_htlc",
+        "remote_max_htlc",
+        "local_disabled",
+        "remote_disabled",
+        "local_alias",
+        "remote_alias",
+        "uptime",
+        "lifetime",
+        "last_forward",
+        "local_fees_msat",
+        "remote_fees",
+        "ins",
+        "ins_percent",
+        "outs",
+        "outs_percent",
+        "opener",
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.last_forward = 0
+        self.local_fees_msat = 0
+        self.remote_fees = 0
+        self.ins = self.outs = 0
+        self.ins_percent = self.outs_percent = 0
@@ -1,138 +1,62 @@
-import json
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from channel import Channel
+from feepolicy import FeePolicy
+from instrument import RpcStats
+
+FWD_PAGE_SIZE = 10000
 
 
 class ClnClient:
-    def __init__(self, client_args):
+    jobs = 1
+
+    def __init__(
+        self,
+        client_args,
+        bulk_graph=False,
+        jobs=None,
+        cache=None,
+        fwd_store=None,
+        fwd_days=30,
+        recorder=None,
+        now=None,
+    ):
         self.client_args = client_args
+        self.bulk_graph = bulk_graph
+        self.cache = cache
+        self.fwd_store = fwd_store
+        self.fwd_days = fwd_days
+        # the forwarding window ends at now, or at the time of every refresh
+        self.now = now
+        if jobs:
+            self.jobs = jobs
+        self.rpc_stats = RpcStats()
+        if recorder is not None:
+            recorder.attach(self)
         self.refresh()
 
+    def close(self):
+        # transports that hold a connection of their own release it here
+        pass
+
     def refresh(self):
         gi = self._run("getinfo")
         self.local_pubkey = gi["id"]
         self.local_alias = gi["alias"]
         self.channels = {}
 
-        peers = self._run("listpeers")["peers"]
-        for p in (peer["id"] for peer in peers if peer["num_channels"] > 0):
-              peer_channels = self._run("listpeerchannels", p)["channels"]
-              for c in peer_channels:
-                  chan = Channel()
-                  chan.chan_id = c.get("short_channel_id")
-                  chan.active = c["state"] == "CHANNELD_NORMAL"
-                  chan.opener = c["opener"]
-                  chan.private = c["private"]
-                  chan.local_node_id, chan.remote_node_id = self.local_pubkey, p
-                  chan.channel_point = c["channel_id"]
-                  chan.uptime, chan.lifetime = None, None
-                  total_msat = self._resolve_total_msat(c)
-                  to_us_msat = self._resolve_to_us_msat(c)
-                  chan.capacity, chan.commit_fee = (
-                      total_msat // 1000,
-                      self._cleanup_msat_value(c["last_tx_fee_msat"]) // 1000,
-                  )
-                  chan.local_balance, chan.remote_balance = (
-                      to_us_msat // 1000,
-                      (total_msat - to_us_msat) // 1000,
-                  )
-                  chan.ins = c["in_payments_fulfilled"]
-                  chan.ins_percent = chan.outs_percent = 0
-                  if chan.ins > 0:
-                      chan.ins_percent = chan.ins / c["in_payments_offered"]
-                  chan.outs = c["out_payments_fulfilled"]
-                  if chan.outs > 0:
-                      chan.outs_percent = chan.outs / c["out_payments_offered"]
-                  if chan.chan_id is not None:
-                      info = self._run("listchannels", chan.chan_id)["channels"]
-                  else:
-                      info = {}
-                  if len(info) > 0:
-                      node1_fee = (
-                          int(info[0]["base_fee_millisatoshi"]),
-                          int(info[0]["fee_per_millionth"]),
-                      )
-                      node1_htlc = (
-                          self._cleanup_msat_value(info[0]["htlc_minimum_msat"]),
-                          self._cleanup_msat_value(info[0]["htlc_maximum_msat"]),
-                      )
-                      node1_disabled = not info[0]["active"]
-                      if len(info) > 1:
-                          node2_fee = (
-                              int(info[1]["base_fee_millisatoshi"]),
-                              int(info[1]["fee_per_millionth"]),
-                          )
-                          node2_htlc = (
-                              self._cleanup_msat_value(info[1]["htlc_minimum_msat"]),
-                              self._cleanup_msat_value(info[1]["htlc_maximum_msat"]),
-                          )
-                          node2_disabled = not info[1]["active"]
-                          if info[0]["source"] != self.local_pubkey:
-                              assert info[1]["source"] == self.local_pubkey
-                              fee_remote = node1_fee
-                              fee_local = node2_fee
-                              htlc_remote = node1_htlc
-                              htlc_local = node2_htlc
-                              disabled_remote = node1_disabled
-                              disabled_local = node2_disabled
-                      if len(info) > 1:
-                          if info[1]["source"] != self.local_pubkey:
-                              assert info[0]["source"] == self.local_pubkey
-                              fee_local = node1_fee
-                              fee_remote = node2_fee
-                              htlc_local = node1_htlc
-                              htlc_remote = node2_htlc
-                              disabled_local = node1_disabled
-                              disabled_remote = node2_disabled
-                      else:
-                          fee_local = node1_fee
-                          fee_remote = 0, 0
-                          htlc_local = node1_htlc
-                          htlc_remote = None, None
-                          disabled_local = node1_disabled
-                          disabled_remote = None
-                  else:
-                      fee_local = 0, 0
-                      fee_remote = 0, 0
-                      htlc_local = None, None
-                      htlc_remote = None, None
-                      disabled_local = None
-                      disabled_remote = None
-
-                  chan.local_base_fee, chan.local_fee_rate = fee_local
-                  chan.remote_base_fee, chan.remote_fee_rate = fee_remote
-                  chan.local_min_htlc, chan.local_max_htlc = htlc_local
-                  chan.remote_min_htlc, chan.remote_max_htlc = htlc_remote
-                  chan.local_disabled = disabled_local
-                  chan.remote_disabled = disabled_remote
-                  chan.local_alias = self.local_alias
-                  listnode = self._run("listnodes", chan.remote_node_id)
-                  if len(listnode["nodes"]) > 0:
-                      chan.remote_alias = listnode["nodes"][0].get(
-                          "alias", chan.remote_node_id
-                      )
-                  else:
-                      chan.remote_alias = chan.remote_node_id
-                  chan.last_forward = 0
-                  chan.local_fees_msat = 0
-                  chan.remote_fees = 0
-
-                  self.channels[chan.chan_id] = chan
-
-        fwd_events = self._run("listforwards", "status=settled")["forwards"]
-        for fe in fwd_events:
-            cin = fe["in_channel"]
-            cout = fe["out_channel"]
-            ts = int(fe.get("resolved_time", 0))
-            #
-            # 23.05 naming change renamed everything to _msat
-            if "fee" in fe:
-                fee = fe["fee"]
-                amount_in = fe["in_msatoshi"] // 1000
-            else:
-                fee = fe["fee_msat"]
-                amount_in = fe["in_msat"] // 1000
+        if self.bulk_graph:
+            self._refresh_bulk()
+        else:
+            self._refresh_per_peer()
+
+        self.refreshed_at = int(time.time() if self.now is None else self.now)
+        start_time = self.refreshed_at - self.fwd_days * 86400
+        for ts_ns, cin, cout, amount_in_msat, fee in self._forwards(start_time):
+            ts = ts_ns // 1000000000
+            amount_in = amount_in_msat // 1000
             if cin in self.channels:
                 self.channels[cin].last_forward = max(
                     ts, self.channels[cin].last_forward
@@ -147,16 +71,283 @@ class ClnClient:
                 )
                 self.channels[cout].local_fees_msat += fee
 
-    def apply_fee_policy(self, policy):
-        for c in self.channels.values():
-            if c.chan_id is not None:
-                base_fee, fee_rate, _ = policy.calculate(c)
-                self._run(
+        if self.cache is not None:
+            self.cache.flush()
+
+    def plan_fee_policy(self, policy, tolerance=0):
+        channels = (c for c in self.channels.values() if c.chan_id is not None)
+        return list(policy.changes(channels, tolerance))
+
+    def apply_fee_policy(self, policy, tolerance=0):
+        updates = self.plan_fee_policy(policy, tolerance)
+        self.update_fees(updates)
+        return updates
+
+    def update_fees(self, updates):
+        # a single setchannel for all channels when they all get the same
+        # new policy, otherwise one (pipelined) call per changed channel
+        if (
+            len(updates) > 1
+            and len(updates) == len(self.channels)
+            and len({u[1:] for u in updates}) == 1
+        ):
+            targets = ["all"]
+        else:
+            targets = [c.chan_id for c, *_ in updates]
+        calls = []
+        for target, (c, base_fee, fee_rate, _) in zip(targets, updates):
+            calls.append(
+                (
                     "setchannel",
-                    c.chan_id,
+                    target,
                     str(base_fee),
-                    str(int(fee_rate * 1000000)),
+                    str(FeePolicy.ppm(fee_rate)),
+                )
+            )
+        # patch the channels in place from what lightningd confirmed rather
+        # than refreshing everything
+        for response in self._run_many(calls):
+            for confirmed in response.get("channels", []):
+                c = self.channels.get(confirmed.get("short_channel_id"))
+                if c is not None:
+                    c.local_base_fee = self._cleanup_msat_value(
+                        confirmed["fee_base_msat"]
+                    )
+                    c.local_fee_rate = confirmed["fee_proportional_millionths"]
+        # our own policies just changed, do not serve them from the cache
+        if self.cache is not None:
+            for c, *_ in updates:
+                self.cache.invalidate(self.local_pubkey, "chaninfo", c.chan_id)
+            self.cache.flush()
+
+    def verify_fees(self, updates):
+        # re-read only the channels that were touched
+        calls = [("listchannels", c.chan_id) for c, *_ in updates]
+        for (c, *_), info in zip(updates, self._run_many(calls)):
+            self._apply_listchannels_or_unknown(c, info)
+
+    def _refresh_per_peer(self):
+        peers = self._run("listpeers")["peers"]
+        ids = [peer["id"] for peer in peers if peer["num_channels"] > 0]
+        for chans in self._map(self._peer_channels, ids):
+            for chan in chans:
+                self.channels[chan.chan_id] = chan
+
+    def _peer_channels(self, p):
+        chans = []
+        for c in self._run("listpeerchannels", p)["channels"]:
+            chan = self._new_channel(c, p)
+            if chan.chan_id is not None:
+                info = self._cached(
+                    "chaninfo",
+                    chan.chan_id,
+                    lambda: self._run("listchannels", chan.chan_id)["channels"],
                 )
+            else:
+                info = {}
+            self._apply_listchannels(chan, info)
+            chan.remote_alias = self._cached(
+                "alias", chan.remote_node_id, lambda: self._alias(chan.remote_node_id)
+            )
+            chans.append(chan)
+        return chans
+
+    def _forwards(self, start_time):
+        if self.fwd_store is None:
+            # the indexes only run oldest first and forwards resolve in any
+            # order, so without a store the whole history is paged through
+            # and the window is applied afterwards
+            return self._parse_forwards(self._iter_forwards("created", 0), start_time)
+        # forwards settle some time after they are created, so after the first
+        # full pass the store follows the updated index to also pick up those
+        # that were still in flight on the previous run
+        checkpoint = self.fwd_store.checkpoint(self.local_pubkey)
+        index = "updated" if checkpoint else "created"
+        last = [checkpoint]
+
+        def forwards():
+            for fe in self._iter_forwards(index, checkpoint + 1 if checkpoint else 0):
+                last[0] = max(last[0], fe.get("updated_index", 0))
+                yield fe
+
+        self.fwd_store.add(self.local_pubkey, self._parse_forwards(forwards(), 0))
+        self.fwd_store.set_checkpoint(self.local_pubkey, last[0])
+        return self.fwd_store.events(self.local_pubkey, start_time)
+
+    def _iter_forwards(self, index, start):
+        # page through the index so lightningd never serializes the whole
+        # history into a single response
+        while True:
+            response = self._run(
+                "listforwards",
+                "status=settled",
+                f"index={index}",
+                f"start={start}",
+                f"limit={FWD_PAGE_SIZE}",
+            )
+            if "forwards" not in response:
+                # lightningd before 23.11 has no pagination
+                yield from self._run("listforwards", "status=settled")["forwards"]
+                return
+            forwards = response["forwards"]
+            yield from forwards
+            if len(forwards) < FWD_PAGE_SIZE:
+                return
+            start = forwards[-1][f"{index}_index"] + 1
+
+    @staticmethod
+    def _parse_forwards(fwd_events, start_time):
+        for fe in fwd_events:
+            ts_ns = int(fe.get("resolved_time", 0) * 1000000) * 1000
+            if ts_ns < start_time * 1000000000:
+                continue
+            #
+            # 23.05 naming change renamed everything to _msat
+            if "fee" in fe:
+                fee = fe["fee"]
+                amount_in_msat = fe["in_msatoshi"]
+            else:
+                fee = fe["fee_msat"]
+                amount_in_msat = fe["in_msat"]
+            yield ts_ns, fe["in_channel"], fe["out_channel"], amount_in_msat, fee
+
+    def _alias(self, node_id):
+        listnode = self._run("listnodes", node_id)
+        if len(listnode["nodes"]) > 0:
+            return listnode["nodes"][0].get("alias", node_id)
+        return node_id
+
+    def _cached(self, kind, key, fetch):
+        if self.cache is None:
+            return fetch()
+        return self.cache.fetch(self.local_pubkey, kind, key, fetch)
+
+    def _refresh_bulk(self):
+        # a constant number of calls joined in memory by short_channel_id
+        # and node id instead of three lookups per channel
+        peer_channels = self._run("listpeerchannels")["channels"]
+        sources, destinations, nodes = self._run_many(
+            [
+                ("listchannels", f"source={self.local_pubkey}"),
+                ("listchannels", f"destination={self.local_pubkey}"),
+                ("listnodes",),
+            ]
+        )
+        infos = {}
+        for info in sources["channels"] + destinations["channels"]:
+            infos.setdefault(info["short_channel_id"], []).append(info)
+        aliases = {n["nodeid"]: n.get("alias", n["nodeid"]) for n in nodes["nodes"]}
+        for c in peer_channels:
+            chan = self._new_channel(c, c["peer_id"])
+            self._apply_listchannels(chan, infos.get(chan.chan_id, {}))
+            chan.remote_alias = aliases.get(chan.remote_node_id, chan.remote_node_id)
+            self.channels[chan.chan_id] = chan
+
+    def _new_channel(self, c, peer_id):
+        chan = Channel()
+        chan.chan_id = c.get("short_channel_id")
+        chan.active = c["state"] == "CHANNELD_NORMAL"
+        chan.opener = c["opener"]
+        chan.private = c["private"]
+        chan.local_node_id, chan.remote_node_id = self.local_pubkey, peer_id
+        chan.channel_point = c["channel_id"]
+        chan.uptime, chan.lifetime = None, None
+        total_msat = self._resolve_total_msat(c)
+        to_us_msat = self._resolve_to_us_msat(c)
+        chan.capacity, chan.commit_fee = (
+            total_msat // 1000,
+            self._cleanup_msat_value(c["last_tx_fee_msat"]) // 1000,
+        )
+        chan.local_balance, chan.remote_balance = (
+            to_us_msat // 1000,
+            (total_msat - to_us_msat) // 1000,
+        )
+        chan.ins = c["in_payments_fulfilled"]
+        chan.ins_percent = chan.outs_percent = 0
+        if chan.ins > 0:
+            chan.ins_percent = chan.ins / c["in_payments_offered"]
+        chan.outs = c["out_payments_fulfilled"]
+        if chan.outs > 0:
+            chan.outs_percent = chan.outs / c["out_payments_offered"]
+        chan.local_alias = self.local_alias
+        # setchannel does not manage the cltv delta, leave it out of the diff
+        chan.local_time_lock_delta = None
+        chan.last_forward = 0
+        chan.local_fees_msat = 0
+        chan.remote_fees = 0
+        return chan
+
+    def _apply_listchannels_or_unknown(self, chan, info):
+        # an rpc error, or halves that are not ours and our peer's, leave
+        # the policies of the channel unknown
+        try:
+            self._apply_listchannels(chan, info["channels"])
+        except:
+            chan.local_base_fee, chan.local_fee_rate = None, None
+            chan.remote_base_fee, chan.remote_fee_rate = None, None
+            chan.local_min_htlc, chan.local_max_htlc = None, None
+            chan.remote_min_htlc, chan.remote_max_htlc = None, None
+            chan.local_disabled, chan.remote_disabled = None, None
+
+    def _apply_listchannels(self, chan, info):
+        if len(info) > 0:
+            node1_fee = (
+                int(info[0]["base_fee_millisatoshi"]),
+                int(info[0]["fee_per_millionth"]),
+            )
+            node1_htlc = (
+                self._cleanup_msat_value(info[0]["htlc_minimum_msat"]),
+                self._cleanup_msat_value(info[0]["htlc_maximum_msat"]),
+            )
+            node1_disabled = not info[0]["active"]
+            if len(info) > 1:
+                node2_fee = (
+                    int(info[1]["base_fee_millisatoshi"]),
+                    int(info[1]["fee_per_millionth"]),
+                )
+                node2_htlc = (
+                    self._cleanup_msat_value(info[1]["htlc_minimum_msat"]),
+                    self._cleanup_msat_value(info[1]["htlc_maximum_msat"]),
+                )
+                node2_disabled = not info[1]["active"]
+                if info[0]["source"] != self.local_pubkey:
+                    assert info[1]["source"] == self.local_pubkey
+                    fee_remote = node1_fee
+                    fee_local = node2_fee
+                    htlc_remote = node1_htlc
+                    htlc_local = node2_htlc
+                    disabled_remote = node1_disabled
+                    disabled_local = node2_disabled
+            if len(info) > 1:
+                if info[1]["source"] != self.local_pubkey:
+                    assert info[0]["source"] == self.local_pubkey
+                    fee_local = node1_fee
+                    fee_remote = node2_fee
+                    htlc_local = node1_htlc
+                    htlc_remote = node2_htlc
+                    disabled_local = node1_disabled
+                    disabled_remote = node2_disabled
+            else:
+                fee_local = node1_fee
+                fee_remote = 0, 0
+                htlc_local = node1_htlc
+                htlc_remote = None, None
+                disabled_local = node1_disabled
+                disabled_remote = None
+        else:
+            fee_local = 0, 0
+            fee_remote = 0, 0
+            htlc_local = None, None
+            htlc_remote = None, None
+            disabled_local = None
+            disabled_remote = None
+
+        chan.local_base_fee, chan.local_fee_rate = fee_local
+        chan.remote_base_fee, chan.remote_fee_rate = fee_remote
+        chan.local_min_htlc, chan.local_max_htlc = htlc_local
+        chan.remote_min_htlc, chan.remote_max_htlc = htlc_remote
+        chan.local_disabled = disabled_local
+        chan.remote_disabled = disabled_remote
 
     @staticmethod
     def _resolve_total_msat(channel):
@@ -177,9 +368,21 @@ class ClnClient:
         return value
 
     def _run(self, *args):
+        method = args[0]
         if self.client_args:
             args = ["lightning-cli"] + list(self.client_args) + list(args)
         else:
             args = ["lightning-cli"] + list(args)
+        start = time.perf_counter()
         j = subprocess.run(args, stdout=subprocess.PIPE)
-        return json.loads(j.stdout)
+        return self.rpc_stats.decode(method, j.stdout, start)
+
+    def _run_many(self, calls):
+        return [self._run(*args) for args in calls]
+
+    def _map(self, fn, items):
+        # peers are fetched independently; results keep the input order
+        if self.jobs <= 1:
+            return list(map(fn, items))
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(fn, items))
@@ -0,0 +1,79 @@
+import collections
+import math
+import time
+
+from feepolicy import FeePolicy
+
+
+class FeeDaemon:
+    """
+    applies a fee policy again and again, but only the changes worth
+    gossiping: the fee rate has to move past the hysteresis band (relative to
+    the current rate), a channel is updated at most once per min_interval
+    seconds and at most max_updates channel updates go out per hour
+    """
+
+    def __init__(
+        self,
+        ln,
+        policy,
+        tolerance=0,
+        hysteresis=0.1,
+        min_interval=3600,
+        max_updates=60,
+    ):
+        self.ln = ln
+        self.policy = policy
+        self.tolerance = tolerance
+        self.hysteresis = hysteresis
+        self.min_interval = min_interval
+        self.max_updates = max_updates
+        self.last_update = {}
+        self.recent = collections.deque()
+
+    def plan(self, now=None):
+        """
+        returns the updates to apply now and the number of channels that are
+        due but did not fit into the hourly budget
+        """
+        now = time.time() if now is None else now
+        while self.recent and self.recent[0] <= now - 3600:
+            self.recent.popleft()
+
+        due = []
+        for update in self.ln.plan_fee_policy(self.policy, self.tolerance):
+            c = update[0]
+            drift = self._drift(*update)
+            if drift <= self.hysteresis:
+                continue
+            if now - self.last_update.get(c.chan_id, -math.inf) < self.min_interval:
+                continue
+            due.append((drift, update))
+
+        # the channels furthest off their target go first
+        due.sort(key=lambda d: d[0], reverse=True)
+        budget = max(0, self.max_updates - len(self.recent))
+        updates = [u for _, u in due[:budget]]
+        return updates, len(due) - len(updates)
+
+    def apply(self, updates, now=None):
+        now = time.time() if now is None else now
+        if updates:
+            self.ln.update_fees(updates)
+        for c, *_ in updates:
+            self.last_update[c.chan_id] = now
+            self.recent.append(now)
+
+    @staticmethod
+    def _drift(c, base_fee, fee_rate, time_lock_delta):
+        # a new base fee or time lock delta, or an unknown current policy,
+        # is always past the band
+        if (
+            c.local_fee_rate is None
+            or c.local_base_fee != base_fee
+            or c.local_time_lock_delta not in (None, time_lock_delta)
+        ):
+            return math.inf
+        return abs(FeePolicy.ppm(fee_rate) - c.local_fee_rate) / max(
+            c.local_fee_rate, 1
+        )
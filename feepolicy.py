@@ -8,15 +8,52 @@ class FeePolicy:
         self.fee_spread = fee_spread
         self.time_lock_delta = time_lock_delta
 
+    @staticmethod
+    def ppm(fee_rate):
+        """
+        the fee rate in parts per million that a node keeps for a calculated
+        fee_rate; tables, diffs and updates all go through this one rounding
+        """
+        return round(fee_rate * 1000000)
+
     def calculate(self, channel):
-        ratio = channel.local_balance / (channel.capacity - channel.commit_fee)
-        # -1.0 = all funds local
-        # +1.0 = all funds remote
-        ratio = 1.0 - 2.0 * ratio
-        coef = math.exp(self.fee_spread * ratio)
-        fee_rate = 0.000001 * coef * self.fee_rate
-        if fee_rate < 0.000001:
-            fee_rate = 0.000001
+        return self.calculate_batch([channel])[0]
+
+    def calculate_batch(self, channels):
+        # one pass over all channels with the policy constants bound once, so
+        # many channels (or many candidate policies) stay cheap to evaluate
+        exp = math.exp
+        fee_spread = self.fee_spread
         base_fee = self.base_fee
+        base_fee_rate = self.fee_rate
         time_lock_delta = self.time_lock_delta
-        return base_fee, fee_rate, time_lock_delta
+        result = []
+        for c in channels:
+            ratio = c.local_balance / (c.capacity - c.commit_fee)
+            # -1.0 = all funds local
+            # +1.0 = all funds remote
+            ratio = 1.0 - 2.0 * ratio
+            fee_rate = 0.000001 * exp(fee_spread * ratio) * base_fee_rate
+            if fee_rate < 0.000001:
+                fee_rate = 0.000001
+            result.append((base_fee, fee_rate, time_lock_delta))
+        return result
+
+    def changes(self, channels, tolerance=0):
+        """
+        yields (channel, base_fee, fee_rate, time_lock_delta) for every channel
+        whose current local policy differs from the calculated one; fee rate
+        differences of up to tolerance ppm are ignored
+        """
+        channels = list(channels)
+        for c, (base_fee, fee_rate, time_lock_delta) in zip(
+            channels, self.calculate_batch(channels)
+        ):
+            if (
+                c.local_base_fee == base_fee
+                and c.local_fee_rate is not None
+                and abs(c.local_fee_rate - self.ppm(fee_rate)) <= tolerance
+                and c.local_time_lock_delta in (None, time_lock_delta)
+            ):
+                continue
+            yield c, base_fee, fee_rate, time_lock_delta
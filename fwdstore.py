@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+
+from cache import cache_dir
+
+
+class ForwardStore:
+    def __init__(self, backend, path=None):
+        self.backend = backend
+        if path is None:
+            cache_dir().mkdir(parents=True, exist_ok=True)
+            path = cache_dir() / "forwards.sqlite"
+        # a watch with --events refreshes from the stream threads
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        # a forward is identified by its resolution time, channels and amounts,
+        # so overlapping fetches around the checkpoint are stored only once
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS forwards ("
+            "backend TEXT, node TEXT, timestamp_ns INTEGER, chan_in TEXT, "
+            "chan_out TEXT, amt_in_msat INTEGER, fee_msat INTEGER, "
+            "PRIMARY KEY (backend, node, timestamp_ns, chan_in, chan_out, "
+            "amt_in_msat, fee_msat))"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS forwards_chan_in "
+            "ON forwards (backend, node, chan_in, timestamp_ns)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS forwards_chan_out "
+            "ON forwards (backend, node, chan_out, timestamp_ns)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "backend TEXT, node TEXT, value INTEGER, PRIMARY KEY (backend, node))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS reaches ("
+            "backend TEXT, node TEXT, since INTEGER, PRIMARY KEY (backend, node))"
+        )
+
+    def last_timestamp(self, node):
+        # the checkpoint: resolution time (in seconds) of the newest forward
+        with self.lock:
+            row = self.db.execute(
+                "SELECT MAX(timestamp_ns) FROM forwards WHERE backend = ? AND node = ?",
+                (self.backend, node),
+            ).fetchone()
+            return row[0] // 1000000000 if row[0] is not None else None
+
+    def reach(self, node):
+        # start (in seconds) of the window the store holds every forward of,
+        # None if unknown
+        with self.lock:
+            row = self.db.execute(
+                "SELECT since FROM reaches WHERE backend = ? AND node = ?",
+                (self.backend, node),
+            ).fetchone()
+            return row[0] if row is not None else None
+
+    def set_reach(self, node, since):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO reaches VALUES (?, ?, ?)",
+                (self.backend, node, since),
+            )
+            self.db.commit()
+
+    def checkpoint(self, node):
+        # backend specific position (e.g. a CLN pagination index), 0 if unset
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value FROM checkpoints WHERE backend = ? AND node = ?",
+                (self.backend, node),
+            ).fetchone()
+            return row[0] if row is not None else 0
+
+    def set_checkpoint(self, node, value):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                (self.backend, node, value),
+            )
+            self.db.commit()
+
+    def add(self, node, events):
+        """
+        events yield (timestamp_ns, chan_in, chan_out, amt_in_msat, fee_msat)
+        """
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO forwards VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((self.backend, node) + tuple(e) for e in events),
+            )
+            self.db.commit()
+
+    def events(self, node, since):
+        """
+        yields (timestamp_ns, chan_in, chan_out, amt_in_msat, fee_msat)
+        of the forwards resolved at or after since (in seconds)
+        """
+        # read while holding the lock, a cursor must not be stepped while
+        # another thread uses the connection
+        with self.lock:
+            yield from self.db.execute(
+                "SELECT timestamp_ns, chan_in, chan_out, amt_in_msat, fee_msat "
+                "FROM forwards WHERE backend = ? AND node = ? AND timestamp_ns >= ?",
+                (self.backend, node, since * 1000000000),
+            )
@@ -0,0 +1,129 @@
+import sqlite3
+import time
+
+from cache import cache_dir
+
+# what is kept of every channel on every run; a row is written when one of
+# the tracked fields changed, the fees earned are a sum over the forwarding
+# window that moves on every run and are only kept along with them
+TRACKED = ("local_balance", "local_base_fee", "local_fee_rate")
+FIELDS = TRACKED + ("local_fees_msat",)
+
+DAY = 86400
+
+
+class HistoryStore:
+    """
+    balances and fees of every channel over time; a row is only written when
+    one of them changed, so the last row at or before a time is the state of
+    the channel at that time and frequent runs stay cheap to keep
+    """
+
+    def __init__(self, backend, path=None):
+        self.backend = backend
+        if path is None:
+            cache_dir().mkdir(parents=True, exist_ok=True)
+            path = cache_dir() / "history.sqlite"
+        self.db = sqlite3.connect(str(path))
+        # every row refers to its backend and node by a small integer
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            "id INTEGER PRIMARY KEY, backend TEXT, node TEXT, UNIQUE (backend, node))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            "node_id INTEGER REFERENCES nodes (id), chan_id TEXT, ts INTEGER, "
+            "local_balance INTEGER, local_base_fee INTEGER, local_fee_rate INTEGER, "
+            "local_fees_msat INTEGER, "
+            "PRIMARY KEY (node_id, chan_id, ts)) WITHOUT ROWID"
+        )
+
+    def add(self, node, channels, now=None):
+        now = int(time.time() if now is None else now)
+        node_id = self._node_id(node, create=True)
+        latest = self._states(node_id, now)
+        rows = []
+        # channels waiting to confirm have no chan_id to be kept under yet
+        for c in channels:
+            if c.chan_id is None:
+                continue
+            values = tuple(getattr(c, name) for name in FIELDS)
+            if latest.get(c.chan_id, ())[: len(TRACKED)] != values[: len(TRACKED)]:
+                rows.append((node_id, c.chan_id, now) + values)
+        self.db.executemany(
+            "INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.db.commit()
+
+    def trends(self, node, channels, now=None, drift_days=7):
+        """
+        returns {chan_id: (net flow in sat per day over the last day, local
+        balance drift over the last drift_days, local fee rate of the last
+        run)}, None where the history does not go back far enough
+        """
+        now = int(time.time() if now is None else now)
+        node_id = self._node_id(node)
+        latest = self._states(node_id, now)
+        day_ago = self._states(node_id, now - DAY)
+        drift_ago = self._states(node_id, now - drift_days * DAY)
+        first = self._first_states(node_id)
+        trends = {}
+        for c in channels:
+            if c.chan_id is None:
+                continue
+            if c.chan_id not in latest:
+                trends[c.chan_id] = (None, None, None)
+                continue
+            if c.chan_id in day_ago:
+                flow = c.local_balance - day_ago[c.chan_id][0]
+            else:
+                # less than a day of history is scaled up, once there is at
+                # least an hour of it
+                since, balance = first[c.chan_id]
+                span = now - since
+                flow = (
+                    (c.local_balance - balance) * DAY // span if span >= 3600 else None
+                )
+            drift = (
+                c.local_balance - drift_ago[c.chan_id][0]
+                if c.chan_id in drift_ago
+                else None
+            )
+            trends[c.chan_id] = (flow, drift, latest[c.chan_id][2])
+        return trends
+
+    def _node_id(self, node, create=False):
+        if create:
+            self.db.execute(
+                "INSERT OR IGNORE INTO nodes (backend, node) VALUES (?, ?)",
+                (self.backend, node),
+            )
+        row = self.db.execute(
+            "SELECT id FROM nodes WHERE backend = ? AND node = ?",
+            (self.backend, node),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _states(self, node_id, at):
+        # the last row of every channel at or before at; SQLite takes the
+        # other columns from the row with the maximum
+        return {
+            row[0]: row[2:]
+            for row in self.db.execute(
+                "SELECT chan_id, MAX(ts), local_balance, local_base_fee, "
+                "local_fee_rate, local_fees_msat FROM history "
+                "WHERE node_id = ? AND ts <= ? GROUP BY chan_id",
+                (node_id, at),
+            )
+        }
+
+    def _first_states(self, node_id):
+        # (time, local balance) of the first row of every channel
+        return {
+            row[0]: row[1:]
+            for row in self.db.execute(
+                "SELECT chan_id, MIN(ts), local_balance FROM history "
+                "WHERE node_id = ? GROUP BY chan_id",
+                (node_id,),
+            )
+        }
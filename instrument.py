@@ -0,0 +1,100 @@
+import collections
+import contextlib
+import json
+import threading
+import time
+
+# latencies kept per method for the percentiles, the oldest are dropped first
+# so that a long --watch or daemon run does not grow without bound
+LATENCY_SAMPLES = 10000
+
+
+class RpcStats:
+    """
+    per-method counts, latencies, response sizes and JSON decode times of the
+    calls a client makes; every transport records into one of these
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.seconds = collections.Counter()
+        self.latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=LATENCY_SAMPLES)
+        )
+        self.response_bytes = collections.Counter()
+        self.decode_seconds = collections.Counter()
+
+    def record(self, method, latency=None, size=0, decode=0.0):
+        with self.lock:
+            self.calls[method] += 1
+            if latency is not None:
+                self.seconds[method] += latency
+                self.latencies[method].append(latency)
+            self.response_bytes[method] += size
+            self.decode_seconds[method] += decode
+
+    def decode(self, method, raw, start):
+        """
+        decodes the JSON response raw of a call started at start (a
+        time.perf_counter() value) and records the call
+        """
+        received = time.perf_counter()
+        result = json.loads(raw)
+        self.record(method, received - start, len(raw), time.perf_counter() - received)
+        return result
+
+    def counts(self):
+        with self.lock:
+            return dict(self.calls)
+
+    def summary(self):
+        # slowest methods (in total) first
+        with self.lock:
+            methods = sorted(self.calls, key=lambda m: self.seconds[m], reverse=True)
+            return [
+                {
+                    "method": m,
+                    "calls": self.calls[m],
+                    "seconds": self.seconds[m],
+                    "p50": _percentile(sorted(self.latencies[m]), 0.5),
+                    "p99": _percentile(sorted(self.latencies[m]), 0.99),
+                    "response_bytes": self.response_bytes[m],
+                    "decode_seconds": self.decode_seconds[m],
+                }
+                for m in methods
+            ]
+
+
+class Profile:
+    """
+    wall time spent in each phase of a run, summed over repeated phases
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (
+                time.perf_counter() - start
+            )
+
+    def report(self, rpc_stats=None):
+        return {
+            "total": time.perf_counter() - self.start,
+            "phases": dict(self.phases),
+            "rpcs": rpc_stats.summary() if rpc_stats is not None else [],
+        }
+
+
+def _percentile(values, q):
+    # nearest rank of sorted values
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
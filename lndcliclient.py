@@ -1,5 +1,5 @@
-import json
 import subprocess
+import time
 
 from lndclient import LndClient
 
@@ -17,29 +17,42 @@ class LndCliClient(LndClient):
     def getnodeinfo(self, node_id):
         return self._run("getnodeinfo", node_id)
 
-    def fwd_events(self):
+    def describegraph(self):
+        return self._run("describegraph", "--include_unannounced")
+
+    def fwd_events(self, start_time, index_offset, num_max_events):
         return self._run(
-            "fwdinghistory", "--max_events", "50000", "--start_time", "-30d"
+            "fwdinghistory",
+            "--start_time",
+            str(start_time),
+            "--index_offset",
+            str(index_offset),
+            "--max_events",
+            str(num_max_events),
         )
 
-    def updatechanpolicy(self, channel, policy):
-        base_fee, fee_rate, time_lock_delta = policy.calculate(channel)
+    def updatechanpolicy(self, channel, base_fee, fee_rate_ppm, time_lock_delta):
+        if channel is None:
+            scope = []
+        else:
+            scope = ["--chan_point", channel.channel_point]
         return self._run(
             "updatechanpolicy",
             "--base_fee_msat",
             str(base_fee),
-            "--fee_rate",
-            "%0.8f" % fee_rate,
+            "--fee_rate_ppm",
+            str(fee_rate_ppm),
             "--time_lock_delta",
             str(time_lock_delta),
-            "--chan_point",
-            channel.channel_point,
+            *scope,
         )
 
     def _run(self, *args):
+        method = args[0]
         if self.client_args:
             args = ["lncli"] + list(self.client_args) + list(args)
         else:
             args = ["lncli"] + list(args)
+        start = time.perf_counter()
         j = subprocess.run(args, stdout=subprocess.PIPE)
-        return json.loads(j.stdout)
+        return self.rpc_stats.decode(method, j.stdout, start)
@@ -1,11 +1,52 @@
 import abc
+import base64
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from channel import Channel
+from feepolicy import FeePolicy
+from instrument import RpcStats
+
+FWD_PAGE_SIZE = 10000
+
+# seconds to wait before resubscribing to a stream that dropped; doubled
+# after every failure up to the maximum
+RESUBSCRIBE_DELAY = 5
+MAX_RESUBSCRIBE_DELAY = 300
 
 
 class LndClient(abc.ABC):
-    def __init__(self, client_args):
+    jobs = 1
+
+    def __init__(
+        self,
+        client_args,
+        bulk_graph=False,
+        jobs=None,
+        cache=None,
+        fwd_store=None,
+        fwd_days=30,
+        recorder=None,
+        now=None,
+    ):
         self.client_args = client_args
+        self.bulk_graph = bulk_graph
+        self.cache = cache
+        self.fwd_store = fwd_store
+        self.fwd_days = fwd_days
+        # the forwarding window ends at now, or at the time of every refresh
+        self.now = now
+        if jobs:
+            self.jobs = jobs
+        # held while self.channels is rebuilt or patched from an event
+        self.lock = threading.RLock()
+        self.pending_htlcs = {}
+        # the last failure of every event stream that is down, by stream
+        self.stream_errors = {}
+        self.rpc_stats = RpcStats()
+        if recorder is not None:
+            recorder.attach(self)
         self.refresh()
 
     @abc.abstractmethod
@@ -25,11 +66,34 @@ class LndClient(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def fwd_events(self):
+    def fwd_events(self, start_time, index_offset, num_max_events):
         pass
 
     @abc.abstractmethod
-    def updatechanpolicy(self, channel_point, policy):
+    def updatechanpolicy(self, channel, base_fee, fee_rate_ppm, time_lock_delta):
+        """
+        channel None updates the policy of all channels at once; the fee rate
+        is sent in ppm, lnd rounds a fractional fee_rate down
+        """
+        pass
+
+    def describegraph(self):
+        raise NotImplementedError
+
+    # the event streams yield the same dicts as lnd's REST streaming endpoints
+    # (without the "result" wrapper)
+
+    def channel_events(self):
+        raise NotImplementedError
+
+    def htlc_events(self):
+        raise NotImplementedError
+
+    def graph_updates(self):
+        raise NotImplementedError
+
+    def close(self):
+        # transports that hold a connection of their own release it here
         pass
 
     def refresh(self):
@@ -39,90 +103,18 @@ class LndClient(abc.ABC):
         self.channels = {}
 
         channels = self.listchannels()["channels"]
-        for c in channels:
-            chan = Channel()
-            chan.chan_id = c.get("scid", c.get("chan_id"))  # Use scid for lncli 0.19+, fallback to chan_id for older versions
-            chan.active = c["active"]
-            chan.private = c["private"]
-            chan.opener = "local" if c["initiator"] else "remote"
-            chan.local_node_id, chan.remote_node_id = (
-                self.local_pubkey,
-                c["remote_pubkey"],
-            )
-            chan.channel_point = c["channel_point"]
-            chan.uptime, chan.lifetime = int(c["uptime"]), int(c["lifetime"])
-            chan.capacity, chan.commit_fee, chan.local_balance, chan.remote_balance = (
-                int(c["capacity"]),
-                int(c["commit_fee"]),
-                int(c["local_balance"]),
-                int(c["remote_balance"]),
-            )
-            try:
-                info = self.getchaninfo(chan.chan_id)
-                node1_policy = info["node1_policy"]
-                node2_policy = info["node2_policy"]
-                node1_fee = (
-                    int(node1_policy["fee_base_msat"]),
-                    int(node1_policy["fee_rate_milli_msat"]),
-                )
-                node1_htlc = (
-                    int(node1_policy["min_htlc"]),
-                    int(node1_policy["max_htlc_msat"]),
-                )
-                node1_disabled = node1_policy["disabled"]
-                node2_fee = (
-                    int(node2_policy["fee_base_msat"]),
-                    int(node2_policy["fee_rate_milli_msat"]),
-                )
-                node2_htlc = (
-                    int(node2_policy["min_htlc"]),
-                    int(node2_policy["max_htlc_msat"]),
-                )
-                node2_disabled = node2_policy["disabled"]
-                if info["node1_pub"] != self.local_pubkey:
-                    assert info["node2_pub"] == self.local_pubkey
-                    fee_remote = node1_fee
-                    fee_local = node2_fee
-                    htlc_remote = node1_htlc
-                    htlc_local = node2_htlc
-                    disabled_remote = node1_disabled
-                    disabled_local = node2_disabled
-                if info["node2_pub"] != self.local_pubkey:
-                    assert info["node1_pub"] == self.local_pubkey
-                    fee_local = node1_fee
-                    fee_remote = node2_fee
-                    htlc_local = node1_htlc
-                    htlc_remote = node2_htlc
-                    disabled_local = node1_disabled
-                    disabled_remote = node2_disabled
-                chan.local_base_fee, chan.local_fee_rate = fee_local
-                chan.remote_base_fee, chan.remote_fee_rate = fee_remote
-                chan.local_min_htlc, chan.local_max_htlc = htlc_local
-                chan.remote_min_htlc, chan.remote_max_htlc = htlc_remote
-                chan.local_disabled = disabled_local
-                chan.remote_disabled = disabled_remote
-            except:
-                chan.local_base_fee, chan.local_fee_rate = None, None
-                chan.remote_base_fee, chan.remote_fee_rate = None, None
-                chan.local_min_htlc, chan.local_max_htlc = None, None
-                chan.remote_min_htlc, chan.remote_max_htlc = None, None
-                chan.local_disabled, chan.remote_disabled = None, None
-            chan.local_alias = self.local_alias
-            chan.remote_alias = self.getnodeinfo(chan.remote_node_id)["node"]["alias"]
-            chan.last_forward = 0
-            chan.local_fees_msat = 0
-            chan.remote_fees = 0
-
+        edges, nodes = self._load_graph() if self.bulk_graph else ({}, {})
+        chans = [self._new_channel(c) for c in channels]
+        lookups = self._map(lambda chan: self._lookup(chan, edges, nodes), chans)
+        for chan, (info, alias) in zip(chans, lookups):
+            self._fill_channel(chan, info, alias)
             self.channels[chan.chan_id] = chan
 
-        fwd_events = self.fwd_events()["forwarding_events"]
-        for fe in fwd_events:
-            cin = fe["chan_id_in"]
-            cout = fe["chan_id_out"]
-            ts = int(fe["timestamp"])
-            fee = int(fe["fee_msat"])
-            amt_in = int(fe["amt_in"])
-            amt_out = int(fe["amt_out"])
+        self.refreshed_at = int(time.time() if self.now is None else self.now)
+        start_time = self.refreshed_at - self.fwd_days * 86400
+        for ts_ns, cin, cout, amt_in_msat, fee in self._forwards(start_time):
+            ts = ts_ns // 1000000000
+            amt_in = amt_in_msat // 1000
             if cin in self.channels:
                 self.channels[cin].last_forward = max(
                     ts, self.channels[cin].last_forward
@@ -137,6 +129,406 @@ class LndClient(abc.ABC):
                 )
                 self.channels[cout].local_fees_msat += fee
 
-    def apply_fee_policy(self, policy):
-        for c in self.channels.values():
-            self.updatechanpolicy(c, policy)
+        if self.cache is not None:
+            self.cache.flush()
+
+    def _new_channel(self, c):
+        chan = Channel()
+        # Use scid for lncli 0.19+, fallback to chan_id for older versions
+        chan.chan_id = c.get("scid", c.get("chan_id"))
+        chan.active = c["active"]
+        chan.private = c["private"]
+        chan.opener = "local" if c["initiator"] else "remote"
+        chan.local_node_id, chan.remote_node_id = (
+            self.local_pubkey,
+            c["remote_pubkey"],
+        )
+        chan.channel_point = c["channel_point"]
+        chan.uptime, chan.lifetime = int(c["uptime"]), int(c["lifetime"])
+        chan.capacity, chan.commit_fee, chan.local_balance, chan.remote_balance = (
+            int(c["capacity"]),
+            int(c["commit_fee"]),
+            int(c["local_balance"]),
+            int(c["remote_balance"]),
+        )
+        return chan
+
+    def _fill_channel(self, chan, info, alias):
+        self._apply_chaninfo_or_unknown(chan, info)
+        chan.local_alias = self.local_alias
+        chan.remote_alias = alias
+        chan.last_forward = 0
+        chan.local_fees_msat = 0
+        chan.remote_fees = 0
+
+    def _forwards(self, start_time):
+        if self.fwd_store is None:
+            return self._parse_fwd_events(self._iter_fwd_events(start_time))
+        # only fetch what happened since the newest stored forward, the
+        # window itself is then read back from the store; a window reaching
+        # further back than the store does is fetched whole once
+        last = self.fwd_store.last_timestamp(self.local_pubkey)
+        reach = self.fwd_store.reach(self.local_pubkey)
+        if last is None or reach is None or start_time < reach:
+            since = start_time
+        else:
+            since = max(start_time, last)
+        self.fwd_store.add(
+            self.local_pubkey, self._parse_fwd_events(self._iter_fwd_events(since))
+        )
+        self.fwd_store.set_reach(
+            self.local_pubkey, start_time if reach is None else min(reach, start_time)
+        )
+        return self.fwd_store.events(self.local_pubkey, start_time)
+
+    def _iter_fwd_events(self, start_time):
+        # page through the whole window instead of a single capped query, only
+        # one page is held in memory at a time
+        index_offset = 0
+        while True:
+            response = self.fwd_events(start_time, index_offset, FWD_PAGE_SIZE)
+            events = response["forwarding_events"]
+            yield from events
+            if len(events) < FWD_PAGE_SIZE:
+                break
+            index_offset = int(response["last_offset_index"])
+
+    @staticmethod
+    def _parse_fwd_events(fwd_events):
+        for fe in fwd_events:
+            # the _ns and _msat fields are missing (or zero) before lnd 0.15
+            ts_ns = int(fe.get("timestamp_ns", 0))
+            if not ts_ns:
+                ts_ns = int(fe["timestamp"]) * 1000000000
+            amt_in_msat = int(fe.get("amt_in_msat", 0))
+            if not amt_in_msat:
+                amt_in_msat = int(fe["amt_in"]) * 1000
+            yield (
+                ts_ns,
+                fe["chan_id_in"],
+                fe["chan_id_out"],
+                amt_in_msat,
+                int(fe["fee_msat"]),
+            )
+
+    def _map(self, fn, items):
+        # the per-channel lookups are independent of each other; results come
+        # back in input order so the output does not depend on scheduling
+        if self.jobs <= 1:
+            return list(map(fn, items))
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(fn, items))
+
+    def _lookup(self, chan, edges, nodes):
+        try:
+            info = edges.get(chan.channel_point) or self._cached(
+                "chaninfo", chan.chan_id, lambda: self.getchaninfo(chan.chan_id)
+            )
+        except:
+            info = None
+        node = nodes.get(chan.remote_node_id)
+        if node is not None:
+            alias = node["alias"]
+        else:
+            alias = self._cached(
+                "alias",
+                chan.remote_node_id,
+                lambda: self.getnodeinfo(chan.remote_node_id)["node"]["alias"],
+            )
+        return info, alias
+
+    def _cached(self, kind, key, fetch):
+        if self.cache is None:
+            return fetch()
+        return self.cache.fetch(self.local_pubkey, kind, key, fetch)
+
+    def _load_graph(self):
+        # index the whole graph by channel point and pubkey so that refresh
+        # does not need a getchaninfo and getnodeinfo call for every channel;
+        # anything missing from the graph falls back to the per-channel calls
+        try:
+            graph = self.describegraph()
+        except:
+            return {}, {}
+        edges = {e["chan_point"]: e for e in graph.get("edges", [])}
+        nodes = {n["pub_key"]: n for n in graph.get("nodes", [])}
+        return edges, nodes
+
+    def _apply_chaninfo_or_unknown(self, chan, info):
+        # a missing edge or policy leaves the policies of the channel unknown
+        try:
+            self._apply_chaninfo(chan, info)
+        except:
+            chan.local_base_fee, chan.local_fee_rate = None, None
+            chan.remote_base_fee, chan.remote_fee_rate = None, None
+            chan.local_min_htlc, chan.local_max_htlc = None, None
+            chan.remote_min_htlc, chan.remote_max_htlc = None, None
+            chan.local_disabled, chan.remote_disabled = None, None
+            chan.local_time_lock_delta = None
+
+    def _apply_chaninfo(self, chan, info):
+        node1_policy = info["node1_policy"]
+        node2_policy = info["node2_policy"]
+        node1_fee = (
+            int(node1_policy["fee_base_msat"]),
+            int(node1_policy["fee_rate_milli_msat"]),
+        )
+        node1_htlc = (
+            int(node1_policy["min_htlc"]),
+            int(node1_policy["max_htlc_msat"]),
+        )
+        node1_disabled = node1_policy["disabled"]
+        node1_time_lock_delta = int(node1_policy["time_lock_delta"])
+        node2_fee = (
+            int(node2_policy["fee_base_msat"]),
+            int(node2_policy["fee_rate_milli_msat"]),
+        )
+        node2_htlc = (
+            int(node2_policy["min_htlc"]),
+            int(node2_policy["max_htlc_msat"]),
+        )
+        node2_disabled = node2_policy["disabled"]
+        node2_time_lock_delta = int(node2_policy["time_lock_delta"])
+        if info["node1_pub"] != self.local_pubkey:
+            assert info["node2_pub"] == self.local_pubkey
+            fee_remote = node1_fee
+            fee_local = node2_fee
+            htlc_remote = node1_htlc
+            htlc_local = node2_htlc
+            disabled_remote = node1_disabled
+            disabled_local = node2_disabled
+            time_lock_delta_local = node2_time_lock_delta
+        if info["node2_pub"] != self.local_pubkey:
+            assert info["node1_pub"] == self.local_pubkey
+            fee_local = node1_fee
+            fee_remote = node2_fee
+            htlc_local = node1_htlc
+            htlc_remote = node2_htlc
+            disabled_local = node1_disabled
+            disabled_remote = node2_disabled
+            time_lock_delta_local = node1_time_lock_delta
+        chan.local_base_fee, chan.local_fee_rate = fee_local
+        chan.remote_base_fee, chan.remote_fee_rate = fee_remote
+        chan.local_min_htlc, chan.local_max_htlc = htlc_local
+        chan.remote_min_htlc, chan.remote_max_htlc = htlc_remote
+        chan.local_disabled = disabled_local
+        chan.remote_disabled = disabled_remote
+        chan.local_time_lock_delta = time_lock_delta_local
+
+    def plan_fee_policy(self, policy, tolerance=0):
+        return list(policy.changes(self.channels.values(), tolerance))
+
+    def apply_fee_policy(self, policy, tolerance=0):
+        updates = self.plan_fee_policy(policy, tolerance)
+        self.update_fees(updates)
+        return updates
+
+    def update_fees(self, updates):
+        # one global update when every channel gets the same new policy
+        if (
+            len(updates) > 1
+            and len(updates) == len(self.channels)
+            and len({u[1:] for u in updates}) == 1
+        ):
+            calls = [((None, *updates[0][1:]), updates)]
+        else:
+            calls = [(u, [u]) for u in updates]
+        # patch the channels in place rather than refreshing everything, but
+        # only those lnd accepted; a call that raises fails all it covered
+        confirmed = []
+        try:
+            for (c, base_fee, fee_rate, time_lock_delta), covered in calls:
+                response = self.updatechanpolicy(
+                    c, base_fee, FeePolicy.ppm(fee_rate), time_lock_delta
+                )
+                failed = {
+                    "%s:%s"
+                    % (f["outpoint"]["txid_str"], f["outpoint"].get("output_index", 0))
+                    for f in response.get("failed_updates", [])
+                }
+                confirmed += [u for u in covered if u[0].channel_point not in failed]
+        finally:
+            for c, base_fee, fee_rate, time_lock_delta in confirmed:
+                c.local_base_fee = base_fee
+                c.local_fee_rate = FeePolicy.ppm(fee_rate)
+                c.local_time_lock_delta = time_lock_delta
+            # our own policies just changed, do not serve them from the cache
+            if self.cache is not None:
+                for c, *_ in updates:
+                    self.cache.invalidate(self.local_pubkey, "chaninfo", c.chan_id)
+                self.cache.flush()
+
+    def verify_fees(self, updates):
+        # re-read only the channels that were touched
+        def getchaninfo(c):
+            try:
+                return self.getchaninfo(c.chan_id)
+            except:
+                return None
+
+        chans = [c for c, *_ in updates]
+        for c, info in zip(chans, self._map(getchaninfo, chans)):
+            self._apply_chaninfo_or_unknown(c, info)
+
+    def subscribe(self):
+        """
+        keep self.channels current from lnd's channel, htlc and graph event
+        streams instead of polling; each stream is followed in a background
+        thread, hold self.lock while reading self.channels
+        """
+        for stream, apply in (
+            (self.channel_events, self.apply_channel_event),
+            (self.htlc_events, self.apply_htlc_event),
+            (self.graph_updates, self.apply_graph_update),
+        ):
+            threading.Thread(
+                target=self._follow, args=(stream, apply), daemon=True
+            ).start()
+
+    def _follow(self, stream, apply):
+        resync = False
+        delay = RESUBSCRIBE_DELAY
+        while True:
+            try:
+                events = stream()
+                if resync:
+                    # anything that happened while the stream was down is
+                    # only seen by a full refresh, done after resubscribing so
+                    # that no event falls in between
+                    with self.lock:
+                        self.pending_htlcs.clear()
+                        self.refresh()
+                for event in events:
+                    with self.lock:
+                        # some transports only fail once the first message is
+                        # due, so a stream counts as up once it delivered one
+                        self.stream_errors.pop(stream.__name__, None)
+                        delay = RESUBSCRIBE_DELAY
+                        apply(event)
+            except NotImplementedError:
+                return
+            except Exception as e:
+                # shown by the live view, which would otherwise just go stale
+                message = str(e).splitlines()[0] if str(e) else type(e).__name__
+                with self.lock:
+                    self.stream_errors[stream.__name__] = (
+                        f"{message}, retrying in {delay}s"
+                    )
+            resync = True
+            time.sleep(delay)
+            delay = min(2 * delay, MAX_RESUBSCRIBE_DELAY)
+
+    def apply_channel_event(self, event):
+        kind = event.get("type")
+        if kind == "OPEN_CHANNEL":
+            chan = self._new_channel(event["open_channel"])
+            self._fill_channel(chan, *self._lookup(chan, {}, {}))
+            self.channels[chan.chan_id] = chan
+        elif kind == "CLOSED_CHANNEL":
+            self.channels.pop(event["closed_channel"]["chan_id"], None)
+        elif kind in ("ACTIVE_CHANNEL", "INACTIVE_CHANNEL"):
+            channel_point = self._channel_point(event[kind.lower()])
+            for chan in self.channels.values():
+                if chan.channel_point == channel_point:
+                    chan.active = kind == "ACTIVE_CHANNEL"
+
+    def apply_htlc_event(self, event):
+        # the amounts come with the forward event, the balances only change
+        # once the same htlc settles
+        key = tuple(
+            event.get(k, "0")
+            for k in (
+                "incoming_channel_id",
+                "incoming_htlc_id",
+                "outgoing_channel_id",
+                "outgoing_htlc_id",
+            )
+        )
+        if event.get("forward_event") is not None:
+            self.pending_htlcs[key] = event["forward_event"]["info"]
+        elif (
+            event.get("forward_fail_event") is not None
+            or event.get("link_fail_event") is not None
+        ):
+            self.pending_htlcs.pop(key, None)
+        elif (
+            event.get("settle_event") is not None
+            and event.get("event_type") == "RECEIVE"
+        ):
+            # lnd sends no amounts for htlcs paid to us, the balances have to
+            # be read again
+            self._reload_balances()
+        elif event.get("settle_event") is not None:
+            info = self.pending_htlcs.pop(key, None)
+            if info is None:
+                return
+            forward = event.get("event_type") == "FORWARD"
+            ts = int(event.get("timestamp_ns", 0)) // 1000000000 or int(time.time())
+            amt_in = int(info.get("incoming_amt_msat", 0)) // 1000
+            amt_out_msat = int(info.get("outgoing_amt_msat", 0))
+            cin, cout = self.channels.get(key[0]), self.channels.get(key[2])
+            if cin is not None:
+                cin.local_balance += amt_in
+                cin.remote_balance -= amt_in
+                if forward:
+                    cin.last_forward = max(ts, cin.last_forward)
+                    if cin.remote_base_fee is not None:
+                        cin.remote_fees += (
+                            cin.remote_base_fee
+                            + cin.remote_fee_rate * amt_in // 1000000
+                        )
+            if cout is not None:
+                cout.local_balance -= amt_out_msat // 1000
+                cout.remote_balance += amt_out_msat // 1000
+                if forward:
+                    cout.last_forward = max(ts, cout.last_forward)
+                    cout.local_fees_msat += (
+                        int(info.get("incoming_amt_msat", 0)) - amt_out_msat
+                    )
+
+    def _reload_balances(self):
+        for c in self.listchannels()["channels"]:
+            chan = self.channels.get(c.get("scid", c.get("chan_id")))
+            if chan is not None:
+                chan.local_balance = int(c["local_balance"])
+                chan.remote_balance = int(c["remote_balance"])
+
+    def apply_graph_update(self, update):
+        for u in update.get("channel_updates") or []:
+            chan = self.channels.get(u["chan_id"])
+            if chan is None or u.get("routing_policy") is None:
+                continue
+            self._apply_policy(
+                chan, u["routing_policy"], u["advertising_node"] == self.local_pubkey
+            )
+            if self.cache is not None:
+                self.cache.invalidate(self.local_pubkey, "chaninfo", chan.chan_id)
+        for n in update.get("node_updates") or []:
+            for chan in self.channels.values():
+                if chan.remote_node_id == n["identity_key"]:
+                    chan.remote_alias = n["alias"]
+        for c in update.get("closed_chans") or []:
+            self.channels.pop(c["chan_id"], None)
+
+    @staticmethod
+    def _apply_policy(chan, policy, local):
+        fee = int(policy["fee_base_msat"]), int(policy["fee_rate_milli_msat"])
+        htlc = int(policy["min_htlc"]), int(policy["max_htlc_msat"])
+        if local:
+            chan.local_base_fee, chan.local_fee_rate = fee
+            chan.local_min_htlc, chan.local_max_htlc = htlc
+            chan.local_disabled = policy.get("disabled", False)
+            chan.local_time_lock_delta = int(policy["time_lock_delta"])
+        else:
+            chan.remote_base_fee, chan.remote_fee_rate = fee
+            chan.remote_min_htlc, chan.remote_max_htlc = htlc
+            chan.remote_disabled = policy.get("disabled", False)
+
+    @staticmethod
+    def _channel_point(point):
+        # the REST API sends the txid as base64 of its reversed bytes
+        if "funding_txid_str" in point:
+            txid = point["funding_txid_str"]
+        else:
+            txid = base64.b64decode(point["funding_txid_bytes"])[::-1].hex()
+        return "%s:%s" % (txid, point.get("output_index", 0))
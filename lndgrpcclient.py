@@ -0,0 +1,314 @@
+import os
+import time
+from pathlib import Path
+
+try:
+    import grpc
+    import lightning_pb2 as ln
+    import lightning_pb2_grpc as lnrpc
+except ImportError:
+    grpc = None
+
+if grpc is not None:
+
+    class _RpcRecorder(
+        grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor
+    ):
+        # protobuf decoding happens inside grpc, so it is part of the latency;
+        # the client's stats only exist once LndClient.__init__ ran
+        def __init__(self, client):
+            self.client = client
+
+        def intercept_unary_unary(self, continuation, client_call_details, request):
+            method = client_call_details.method.rsplit("/", 1)[-1]
+            start = time.perf_counter()
+            outcome = continuation(client_call_details, request)
+            latency = time.perf_counter() - start
+            try:
+                size = outcome.result().ByteSize()
+            except Exception:
+                size = 0
+            self.client.rpc_stats.record(method, latency, size)
+            return outcome
+
+        def intercept_unary_stream(self, continuation, client_call_details, request):
+            self.client.rpc_stats.record(client_call_details.method.rsplit("/", 1)[-1])
+            return continuation(client_call_details, request)
+
+
+try:
+    import router_pb2 as router
+    import router_pb2_grpc as routerrpc
+except ImportError:
+    router = None
+
+from lndclient import LndClient
+
+
+class LndGrpcClient(LndClient):
+    def __init__(self, client_args, **kwargs):
+        if grpc is None:
+            raise RuntimeError(
+                "lnd-grpc client needs grpcio, protobuf and the generated "
+                "lightning_pb2/lightning_pb2_grpc modules"
+            )
+        args = dict(a.split("=", 1) for a in client_args)
+
+        self.rpcserver = args["rpcserver"] if "rpcserver" in args else "localhost:10009"
+        self.macaroonpath = (
+            Path(args["macaroonpath"])
+            if "macaroonpath" in args
+            else Path.home()
+            / ".lnd"
+            / "data"
+            / "chain"
+            / "bitcoin"
+            / "mainnet"
+            / "admin.macaroon"
+        )
+        self.tlscertpath = (
+            Path(args["tlscertpath"])
+            if "tlscertpath" in args
+            else Path.home() / ".lnd" / "tls.cert"
+        )
+
+        with self.macaroonpath.open("rb") as f:
+            macaroon = f.read().hex()
+
+        # lnd uses an ECDSA certificate which is not in grpc's default suites
+        os.environ.setdefault("GRPC_SSL_CIPHER_SUITES", "HIGH+ECDSA")
+        credentials = grpc.composite_channel_credentials(
+            grpc.ssl_channel_credentials(self.tlscertpath.read_bytes()),
+            grpc.metadata_call_credentials(
+                lambda _, callback: callback([("macaroon", macaroon)], None)
+            ),
+        )
+        # a single HTTP/2 channel multiplexes every call; the graph of a
+        # mainnet node is well over the default 4 MB message limit
+        self.channel = grpc.intercept_channel(
+            grpc.secure_channel(
+                self.rpcserver,
+                credentials,
+                options=[("grpc.max_receive_message_length", 256 * 1024 * 1024)],
+            ),
+            _RpcRecorder(self),
+        )
+        self.stub = lnrpc.LightningStub(self.channel)
+        self.router_stub = (
+            routerrpc.RouterStub(self.channel) if router is not None else None
+        )
+
+        super().__init__(client_args, **kwargs)
+
+    def getinfo(self):
+        gi = self.stub.GetInfo(ln.GetInfoRequest())
+        return {"identity_pubkey": gi.identity_pubkey, "alias": gi.alias}
+
+    def listchannels(self):
+        response = self.stub.ListChannels(ln.ListChannelsRequest())
+        return {"channels": [self._channel(c) for c in response.channels]}
+
+    def getchaninfo(self, chan_id):
+        return self._edge(
+            self.stub.GetChanInfo(ln.ChanInfoRequest(chan_id=int(chan_id)))
+        )
+
+    def getnodeinfo(self, node_id):
+        info = self.stub.GetNodeInfo(ln.NodeInfoRequest(pub_key=node_id))
+        return {"node": self._node(info.node)}
+
+    def describegraph(self):
+        graph = self.stub.DescribeGraph(
+            ln.ChannelGraphRequest(include_unannounced=True)
+        )
+        return {
+            "nodes": [self._node(n) for n in graph.nodes],
+            "edges": [self._edge(e) for e in graph.edges],
+        }
+
+    def fwd_events(self, start_time, index_offset, num_max_events):
+        response = self.stub.ForwardingHistory(
+            ln.ForwardingHistoryRequest(
+                start_time=start_time,
+                index_offset=index_offset,
+                num_max_events=num_max_events,
+            )
+        )
+        return {
+            "forwarding_events": [
+                {
+                    "chan_id_in": str(fe.chan_id_in),
+                    "chan_id_out": str(fe.chan_id_out),
+                    "timestamp": fe.timestamp,
+                    "timestamp_ns": fe.timestamp_ns,
+                    "fee_msat": fe.fee_msat,
+                    "amt_in": fe.amt_in,
+                    "amt_in_msat": fe.amt_in_msat,
+                    "amt_out": fe.amt_out,
+                }
+                for fe in response.forwarding_events
+            ],
+            "last_offset_index": response.last_offset_index,
+        }
+
+    def updatechanpolicy(self, channel, base_fee, fee_rate_ppm, time_lock_delta):
+        if channel is None:
+            scope = {"global": True}
+        else:
+            funding_txid_str, output_index = channel.channel_point.split(":")
+            scope = {
+                "chan_point": ln.ChannelPoint(
+                    funding_txid_str=funding_txid_str,
+                    output_index=int(output_index),
+                )
+            }
+        response = self.stub.UpdateChannelPolicy(
+            ln.PolicyUpdateRequest(
+                base_fee_msat=base_fee,
+                fee_rate_ppm=fee_rate_ppm,
+                time_lock_delta=time_lock_delta,
+                **scope,
+            )
+        )
+        return {
+            "failed_updates": [
+                {
+                    "outpoint": {
+                        "txid_str": fu.outpoint.txid_str,
+                        "output_index": fu.outpoint.output_index,
+                    },
+                    "update_error": fu.update_error,
+                }
+                for fu in response.failed_updates
+            ]
+        }
+
+    # the stream is opened before returning so that LndClient can resync
+    # without missing events
+
+    def channel_events(self):
+        stream = self.stub.SubscribeChannelEvents(ln.ChannelEventSubscription())
+        return (self._channel_event(e) for e in stream)
+
+    def htlc_events(self):
+        if self.router_stub is None:
+            raise NotImplementedError
+        stream = self.router_stub.SubscribeHtlcEvents(
+            router.SubscribeHtlcEventsRequest()
+        )
+        return (self._htlc_event(e) for e in stream)
+
+    def graph_updates(self):
+        stream = self.stub.SubscribeChannelGraph(ln.GraphTopologySubscription())
+        return (self._graph_update(u) for u in stream)
+
+    # the messages are mapped onto the same dicts lncli and the REST API
+    # return, with only the fields LndClient.refresh reads
+
+    @staticmethod
+    def _channel(c):
+        return {
+            "chan_id": str(c.chan_id),
+            "active": c.active,
+            "private": c.private,
+            "initiator": c.initiator,
+            "remote_pubkey": c.remote_pubkey,
+            "channel_point": c.channel_point,
+            "uptime": c.uptime,
+            "lifetime": c.lifetime,
+            "capacity": c.capacity,
+            "commit_fee": c.commit_fee,
+            "local_balance": c.local_balance,
+            "remote_balance": c.remote_balance,
+        }
+
+    @staticmethod
+    def _node(n):
+        return {"pub_key": n.pub_key, "alias": n.alias}
+
+    @classmethod
+    def _edge(cls, e):
+        return {
+            "channel_id": str(e.channel_id),
+            "chan_point": e.chan_point,
+            "node1_pub": e.node1_pub,
+            "node2_pub": e.node2_pub,
+            "node1_policy": cls._policy(e, "node1_policy"),
+            "node2_policy": cls._policy(e, "node2_policy"),
+        }
+
+    @staticmethod
+    def _policy(e, field):
+        if not e.HasField(field):
+            return None
+        p = getattr(e, field)
+        return {
+            "time_lock_delta": p.time_lock_delta,
+            "min_htlc": p.min_htlc,
+            "fee_base_msat": p.fee_base_msat,
+            "fee_rate_milli_msat": p.fee_rate_milli_msat,
+            "disabled": p.disabled,
+            "max_htlc_msat": p.max_htlc_msat,
+        }
+
+    @classmethod
+    def _channel_event(cls, e):
+        kind = e.WhichOneof("channel")
+        event = {"type": ln.ChannelEventUpdate.UpdateType.Name(e.type)}
+        if kind == "open_channel":
+            event[kind] = cls._channel(e.open_channel)
+        elif kind == "closed_channel":
+            event[kind] = {
+                "chan_id": str(e.closed_channel.chan_id),
+                "channel_point": e.closed_channel.channel_point,
+            }
+        elif kind in ("active_channel", "inactive_channel"):
+            point = getattr(e, kind)
+            if point.WhichOneof("funding_txid") == "funding_txid_str":
+                txid = point.funding_txid_str
+            else:
+                txid = point.funding_txid_bytes[::-1].hex()
+            event[kind] = {"funding_txid_str": txid, "output_index": point.output_index}
+        return event
+
+    @staticmethod
+    def _htlc_event(e):
+        event = {
+            "incoming_channel_id": str(e.incoming_channel_id),
+            "outgoing_channel_id": str(e.outgoing_channel_id),
+            "incoming_htlc_id": str(e.incoming_htlc_id),
+            "outgoing_htlc_id": str(e.outgoing_htlc_id),
+            "timestamp_ns": e.timestamp_ns,
+            "event_type": router.HtlcEvent.EventType.Name(e.event_type),
+        }
+        kind = e.WhichOneof("event")
+        if kind in ("forward_event", "link_fail_event"):
+            info = getattr(e, kind).info
+            event[kind] = {
+                "info": {
+                    "incoming_amt_msat": info.incoming_amt_msat,
+                    "outgoing_amt_msat": info.outgoing_amt_msat,
+                }
+            }
+        elif kind is not None:
+            event[kind] = {}
+        return event
+
+    @classmethod
+    def _graph_update(cls, u):
+        return {
+            "node_updates": [
+                {"identity_key": n.identity_key, "alias": n.alias}
+                for n in u.node_updates
+            ],
+            "channel_updates": [
+                {
+                    "chan_id": str(c.chan_id),
+                    "advertising_node": c.advertising_node,
+                    "connecting_node": c.connecting_node,
+                    "routing_policy": cls._policy(c, "routing_policy"),
+                }
+                for c in u.channel_updates
+            ],
+            "closed_chans": [{"chan_id": str(c.chan_id)} for c in u.closed_chans],
+        }
@@ -1,16 +1,16 @@
 import json
 import posixpath
 import time
-from datetime import datetime, timedelta
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from lndclient import LndClient
 
 
 class LndRestClient(LndClient):
-    def __init__(self, client_args):
+    def __init__(self, client_args, **kwargs):
         args = dict(a.split("=", 1) for a in client_args)
 
         self.rpcserver = (
@@ -33,13 +33,38 @@ class LndRestClient(LndClient):
             else Path.home() / ".lnd" / "tls.cert"
         )
 
+        self.pool_size = int(args["pool"]) if "pool" in args else 8
+        self.jobs = self.pool_size
+        self.timeout = float(args["timeout"]) if "timeout" in args else 60.0
+
         self.api_base = posixpath.join(self.rpcserver, "v1")
 
         with self.macaroonpath.open("rb") as f:
             macaroon = f.read().hex()
             self.headers = {"Grpc-Metadata-macaroon": macaroon}
 
-        super().__init__(client_args)
+        # one keep-alive session so the TCP and TLS handshakes are paid once
+        # per pooled connection instead of once per request; --jobs may ask
+        # for more parallel calls than the pool holds
+        self.session = self._session(max(kwargs.get("jobs") or 0, self.pool_size))
+        # the --events streams hold their connections open for as long as
+        # they run, so they do not take them from the pool above
+        self.stream_session = self._session(3)
+
+        super().__init__(client_args, **kwargs)
+
+    def _session(self, pool_maxsize):
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.verify = self.tlscertpath
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+        self.stream_session.close()
 
     def getinfo(self):
         return self._do_get("getinfo")
@@ -53,41 +78,75 @@ class LndRestClient(LndClient):
     def getnodeinfo(self, node_id):
         return self._do_get("graph/node", node_id)
 
-    def fwd_events(self):
-        start_date = datetime.now() - timedelta(days=30)
+    def describegraph(self):
+        return self._do_get("graph", include_unannounced="true")
+
+    def fwd_events(self, start_time, index_offset, num_max_events):
         return self._do_post(
             "switch",
-            num_max_events=50000,
-            start_time=str(int(time.mktime(start_date.timetuple()))),
+            start_time=str(start_time),
+            index_offset=index_offset,
+            num_max_events=num_max_events,
         )
 
-    def updatechanpolicy(self, channel, policy):
-        base_fee, fee_rate, time_lock_delta = policy.calculate(channel)
-        funding_txid_str, output_index = channel.channel_point.split(":")
+    def updatechanpolicy(self, channel, base_fee, fee_rate_ppm, time_lock_delta):
+        if channel is None:
+            scope = {"global": True}
+        else:
+            funding_txid_str, output_index = channel.channel_point.split(":")
+            scope = {
+                "chan_point": {
+                    "funding_txid_str": funding_txid_str,
+                    "output_index": int(output_index),
+                }
+            }
         return self._do_post(
             "chanpolicy",
-            chan_point={
-                "funding_txid_str": funding_txid_str,
-                "output_index": int(output_index),
-            },
             base_fee_msat=str(base_fee),
-            fee_rate=fee_rate,
+            fee_rate_ppm=fee_rate_ppm,
             time_lock_delta=time_lock_delta,
+            **scope,
         )
 
-    def _do_get(self, method, *args):
-        response = requests.get(
+    def channel_events(self):
+        return self._do_stream("v1/channels/subscribe")
+
+    def htlc_events(self):
+        return self._do_stream("v2/router/htlcevents")
+
+    def graph_updates(self):
+        return self._do_stream("v1/graph/subscribe")
+
+    def _do_get(self, method, *args, **params):
+        start = time.perf_counter()
+        response = self.session.get(
             posixpath.join(self.api_base, method, *args),
-            headers=self.headers,
-            verify=self.tlscertpath,
+            params=params,
+            timeout=self.timeout,
         )
-        return json.loads(response.text)
+        # the raw bytes, response.text would first guess their encoding
+        return self.rpc_stats.decode(method, response.content, start)
 
     def _do_post(self, method, **data):
-        response = requests.post(
+        start = time.perf_counter()
+        response = self.session.post(
             posixpath.join(self.api_base, method),
-            headers=self.headers,
             data=json.dumps(data),
-            verify=self.tlscertpath,
+            timeout=self.timeout,
+        )
+        # an rpc error comes back as a {"code", "message"} body, which must
+        # not be mistaken for a response without failed updates
+        response.raise_for_status()
+        return self.rpc_stats.decode(method, response.content, start)
+
+    def _do_stream(self, path):
+        self.rpc_stats.record(path)
+        # a stream can stay quiet for a long time, only connecting is subject
+        # to the timeout; every line is one {"result": ...} message
+        response = self.stream_session.get(
+            posixpath.join(self.rpcserver, path),
+            stream=True,
+            timeout=(self.timeout, None),
         )
-        return json.loads(response.text)
+        response.raise_for_status()
+        return (json.loads(line)["result"] for line in response.iter_lines() if line)
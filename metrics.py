@@ -0,0 +1,175 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# name, help, value of a channel (None to leave the channel out)
+CHANNEL_GAUGES = (
+    ("capacity_sat", "Channel capacity.", lambda c, now: c.capacity),
+    ("local_balance_sat", "Local balance.", lambda c, now: c.local_balance),
+    ("remote_balance_sat", "Remote balance.", lambda c, now: c.remote_balance),
+    ("active", "Whether the channel is active.", lambda c, now: int(c.active)),
+    ("local_base_fee_msat", "Local base fee.", lambda c, now: c.local_base_fee),
+    ("local_fee_rate_ppm", "Local fee rate.", lambda c, now: c.local_fee_rate),
+    ("remote_base_fee_msat", "Remote base fee.", lambda c, now: c.remote_base_fee),
+    ("remote_fee_rate_ppm", "Remote fee rate.", lambda c, now: c.remote_fee_rate),
+    (
+        "uptime_ratio",
+        "Share of the channel lifetime the peer was online.",
+        lambda c, now: (
+            c.uptime / c.lifetime if c.uptime is not None and c.lifetime else None
+        ),
+    ),
+    (
+        "local_fees_msat",
+        "Fees earned by forwarding out of the channel.",
+        lambda c, now: c.local_fees_msat,
+    ),
+    (
+        "last_forward_age_seconds",
+        "Time since the last forward through the channel.",
+        lambda c, now: now - c.last_forward if c.last_forward else None,
+    ),
+)
+
+
+class MetricsExporter:
+    """
+    refreshes the node in a background thread and serves the last snapshot
+    of its channels, so that a scrape never waits for (or causes) an RPC
+    """
+
+    def __init__(self, connect, interval=60):
+        self.connect = connect
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.ln = None
+        self.channels = []
+        self.refresh_duration = None
+        self.refreshed_at = None
+        self.refresh_errors = 0
+
+    def run(self):
+        while True:
+            start = time.monotonic()
+            try:
+                if self.ln is None:
+                    self.ln = self.connect()
+                else:
+                    self.ln.refresh()
+            except Exception:
+                with self.lock:
+                    self.refresh_errors += 1
+            else:
+                with self.lock:
+                    self.channels = list(self.ln.channels.values())
+                    self.refresh_duration = time.monotonic() - start
+                    self.refreshed_at = time.time()
+            time.sleep(self.interval)
+
+    def serve(self, listen):
+        host, port = listen.rsplit(":", 1)
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        threading.Thread(target=self.run, daemon=True).start()
+        server = ThreadingHTTPServer((host.strip("[]"), int(port)), Handler)
+        server.serve_forever()
+
+    def render(self):
+        with self.lock:
+            ln = self.ln
+            channels = self.channels
+            refresh_duration = self.refresh_duration
+            refreshed_at = self.refreshed_at
+            refresh_errors = self.refresh_errors
+        rpc_calls = ln.rpc_stats.counts() if ln is not None else {}
+        now = time.time()
+        lines = []
+
+        def family(name, kind, description, samples):
+            lines.append(f"# TYPE suez_{name} {kind}")
+            lines.append(f"# HELP suez_{name} {description}")
+            for labels, value in samples:
+                if value is not None:
+                    suffix = "_total" if kind == "counter" else ""
+                    lines.append(f"suez_{name}{suffix}{_labels(labels)} {value}")
+
+        for name, description, value in CHANNEL_GAUGES:
+            family(
+                "channel_" + name,
+                "gauge",
+                description,
+                ((_channel_labels(c), value(c, now)) for c in channels),
+            )
+
+        family("channels", "gauge", "Number of channels.", [({}, len(channels))])
+        for name, attr, description in (
+            ("capacity_sat", "capacity", "Total channel capacity."),
+            ("local_balance_sat", "local_balance", "Total local balance."),
+            ("remote_balance_sat", "remote_balance", "Total remote balance."),
+            ("local_fees_msat", "local_fees_msat", "Total fees earned."),
+        ):
+            total = sum(getattr(c, attr) for c in channels)
+            family(name, "gauge", description, [({}, total)])
+
+        family(
+            "refresh_duration_seconds",
+            "gauge",
+            "Duration of the last successful refresh.",
+            [({}, refresh_duration)],
+        )
+        family(
+            "refresh_timestamp_seconds",
+            "gauge",
+            "Time of the last successful refresh.",
+            [({}, refreshed_at)],
+        )
+        family(
+            "refresh_errors",
+            "counter",
+            "Refreshes that failed.",
+            [({}, refresh_errors)],
+        )
+        family(
+            "rpc_calls",
+            "counter",
+            "RPC calls made to the node, by method.",
+            [({"method": m}, n) for m, n in sorted(rpc_calls.items())],
+        )
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _channel_labels(c):
+    return {
+        "chan_id": c.chan_id,
+        "remote_pubkey": c.remote_node_id,
+        "alias": c.remote_alias or "",
+        "private": "true" if c.private else "false",
+    }
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,95 @@
+import csv
+import json
+from operator import attrgetter
+
+from channel import Channel
+
+FORMATS = ("json", "ndjson", "csv")
+
+
+def write_channels(channels, terminal_web, fmt, f):
+    """
+    writes one record per channel and a final totals record to f, with the
+    raw Channel values instead of the formatted table cells
+    """
+    fields = ["type", *Channel.__slots__]
+    if terminal_web.show_good_peers:
+        fields += ["good_inbound_peer", "good_outbound_peer"]
+    if terminal_web.show_scores:
+        fields += ["score"]
+    values = attrgetter(*Channel.__slots__)
+
+    totals = Totals()
+
+    def records():
+        for c in channels:
+            totals.add(c)
+            record = ["channel", *values(c)]
+            if terminal_web.show_good_peers:
+                record += [
+                    terminal_web.is_good_inbound_peer(c.remote_node_id),
+                    terminal_web.is_good_outbound_peer(c.remote_node_id),
+                ]
+            if terminal_web.show_scores:
+                record += [terminal_web.get_score(c.remote_node_id)]
+            yield record
+
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        writer.writerows(records())
+        total = totals.record()
+        writer.writerow(total.get(name) for name in fields)
+    elif fmt == "ndjson":
+        for record in records():
+            f.write(json.dumps(dict(zip(fields, record))) + "\n")
+        f.write(json.dumps(totals.record()) + "\n")
+    else:  # json
+        f.write('{"channels": [')
+        for i, record in enumerate(records()):
+            f.write(("\n" if i == 0 else ",\n") + json.dumps(dict(zip(fields, record))))
+        f.write('\n], "totals": ' + json.dumps(totals.record()) + "}\n")
+
+
+class Totals:
+    # the same sums and averages as the totals row of the channel table
+
+    def __init__(self):
+        self.channels = 0
+        self.capacity = 0
+        self.local_balance = 0
+        self.remote_balance = 0
+        self.local_fees_msat = 0
+        self.remote_fees = 0
+        self.fees = {
+            "local_base_fee": [],
+            "local_fee_rate": [],
+            "remote_base_fee": [],
+            "remote_fee_rate": [],
+        }
+
+    def add(self, c):
+        self.channels += 1
+        self.capacity += c.capacity
+        self.local_balance += c.local_balance
+        self.remote_balance += c.remote_balance
+        self.local_fees_msat += c.local_fees_msat
+        self.remote_fees += c.remote_fees
+        for name, fees in self.fees.items():
+            fee = getattr(c, name)
+            if fee is not None:
+                fees.append(fee)
+
+    def record(self):
+        record = {
+            "type": "totals",
+            "channels": self.channels,
+            "capacity": self.capacity,
+            "local_balance": self.local_balance,
+            "remote_balance": self.remote_balance,
+            "local_fees_msat": self.local_fees_msat,
+            "remote_fees": self.remote_fees,
+        }
+        for name, fees in self.fees.items():
+            record[name] = sum(fees) // len(fees) if fees else None
+        return record
@@ -0,0 +1,170 @@
+import gzip
+import json
+import threading
+import time
+
+from clnclient import ClnClient
+from lndclient import LndClient
+
+# LndClient methods whose responses are recorded, with the arguments that
+# identify a response; the start of the forwarding history moves with the
+# clock, so only the page is part of its key
+LND_METHODS = {
+    "getinfo": lambda: (),
+    "listchannels": lambda: (),
+    "getchaninfo": lambda chan_id: (chan_id,),
+    "getnodeinfo": lambda node_id: (node_id,),
+    "describegraph": lambda: (),
+    "fwd_events": lambda start_time, index_offset, num_max_events: (
+        index_offset,
+        num_max_events,
+    ),
+}
+
+
+class Recorder:
+    """
+    keeps every response a client gets from its node, to be saved as a
+    snapshot that ReplayLndClient or ReplayClnClient answer from later
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.client = None
+
+    def attach(self, client):
+        self.client = client
+        # instance attributes, so that every call the client makes to itself
+        # goes through the recorder
+        if self.kind == "lnd":
+            for name, key in LND_METHODS.items():
+                setattr(client, name, self._wrap(name, getattr(client, name), key))
+        else:
+            # lightning-cli style calls: the method and its arguments
+            client._run = self._wrap("_run", client._run)
+            run_many = client._run_many
+
+            def recorded_run_many(calls):
+                responses = run_many(calls)
+                with self.lock:
+                    for args, response in zip(calls, responses):
+                        self.responses[_key("_run", args)] = response
+                return responses
+
+            client._run_many = recorded_run_many
+
+    def _wrap(self, name, fn, key=lambda *args: args):
+        def recorded(*args):
+            response = fn(*args)
+            with self.lock:
+                self.responses[_key(name, key(*args))] = response
+            return response
+
+        return recorded
+
+    def save(self, path):
+        with self.lock:
+            snapshot = {
+                "kind": self.kind,
+                # the end of the forwarding window, for the replay to match
+                "recorded_at": getattr(self.client, "refreshed_at", time.time()),
+                "responses": self.responses,
+            }
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+
+
+def load(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def replay_client(path, **kwargs):
+    snapshot = load(path)
+    if snapshot["kind"] == "lnd":
+        return ReplayLndClient(snapshot, **kwargs)
+    return ReplayClnClient(snapshot, **kwargs)
+
+
+class ReplayLndClient(LndClient):
+    """
+    answers from a snapshot instead of a node; fee updates are accepted and
+    go nowhere
+    """
+
+    def __init__(self, snapshot, **kwargs):
+        self.responses = snapshot["responses"]
+        super().__init__([], now=snapshot["recorded_at"], **kwargs)
+
+    def getinfo(self):
+        return self._replay("getinfo")
+
+    def listchannels(self):
+        return self._replay("listchannels")
+
+    def getchaninfo(self, chan_id):
+        return self._replay("getchaninfo", chan_id)
+
+    def getnodeinfo(self, node_id):
+        return self._replay("getnodeinfo", node_id)
+
+    def describegraph(self):
+        return self._replay("describegraph")
+
+    def fwd_events(self, start_time, index_offset, num_max_events):
+        return self._replay(
+            "fwd_events",
+            *LND_METHODS["fwd_events"](start_time, index_offset, num_max_events),
+        )
+
+    def updatechanpolicy(self, channel, base_fee, fee_rate_ppm, time_lock_delta):
+        self.rpc_stats.record("updatechanpolicy")
+        return {"failed_updates": []}
+
+    def _replay(self, name, *args):
+        self.rpc_stats.record(name)
+        return _lookup(self.responses, name, args)
+
+
+class ReplayClnClient(ClnClient):
+    """
+    answers from a snapshot instead of lightningd; fee updates are accepted
+    and go nowhere
+    """
+
+    def __init__(self, snapshot, **kwargs):
+        self.responses = snapshot["responses"]
+        super().__init__([], now=snapshot["recorded_at"], **kwargs)
+
+    def _run(self, *args):
+        self.rpc_stats.record(args[0])
+        if args[0] == "setchannel":
+            target, base_fee, fee_rate = args[1:4]
+            ids = list(self.channels) if target == "all" else [target]
+            return {
+                "channels": [
+                    {
+                        "short_channel_id": chan_id,
+                        "fee_base_msat": int(base_fee),
+                        "fee_proportional_millionths": int(fee_rate),
+                    }
+                    for chan_id in ids
+                ]
+            }
+        return _lookup(self.responses, "_run", args)
+
+
+def _key(name, args):
+    return json.dumps([name, *args])
+
+
+def _lookup(responses, name, args):
+    try:
+        return responses[_key(name, args)]
+    except KeyError:
+        raise LookupError(
+            f"{name}{tuple(args)} is not in the snapshot, "
+            "replay with the options it was recorded with"
+        ) from None
@@ -1,14 +1,32 @@
+import contextlib
+import heapq
+import itertools
+import json
+import sys
+import time
 from datetime import datetime
 
 import click
 from rich import box, markup
-from rich.console import Console
+from rich.console import Console, Group
+from rich.live import Live
 from rich.table import Table
 
+from cache import Cache
+from channel import Channel
 from clnclient import ClnClient
+from clnsocketclient import ClnSocketClient
+from feedaemon import FeeDaemon
 from feepolicy import FeePolicy
+from fwdstore import ForwardStore
+from history import HistoryStore
+from instrument import Profile
 from lndcliclient import LndCliClient
+from lndgrpcclient import LndGrpcClient
 from lndrestclient import LndRestClient
+from metrics import MetricsExporter
+from output import FORMATS, Totals, write_channels
+from snapshot import Recorder, replay_client
 from terminal_web import TerminalWeb
 
 
@@ -16,6 +34,33 @@ def _sort_channels(c):
     return c.local_balance / (c.capacity - c.commit_fee)
 
 
+# name: (key, descending); "ratio" is the usual order of the table, the most
+# inbound liquidity first
+SORT_KEYS = {
+    "ratio": (_sort_channels, False),
+    "capacity": (lambda c: c.capacity, True),
+    "inbound": (lambda c: c.remote_balance, True),
+    "outbound": (lambda c: c.local_balance, True),
+    "fees": (lambda c: c.local_fees_msat, True),
+    "fee-rate": (lambda c: c.local_fee_rate or 0, True),
+    "last-forward": (lambda c: c.last_forward or 0, True),
+    "alias": (lambda c: (c.remote_alias or c.remote_node_id).casefold(), False),
+}
+
+
+def sort_channels(channels, sort_by="ratio", top=None):
+    """
+    the channels in table order, or only the first top of them; those are
+    picked with a heap in O(n log top) instead of sorting all channels
+    """
+    key, descending = SORT_KEYS[sort_by]
+    if top is None or top >= len(channels):
+        return sorted(channels, key=key, reverse=descending)
+    if descending:
+        return heapq.nlargest(top, channels, key=key)
+    return heapq.nsmallest(top, channels, key=key)
+
+
 def _since(ts):
     d = datetime.utcnow() - datetime.utcfromtimestamp(ts)
     return f"{d.total_seconds() / 86400:.1f}"
@@ -65,6 +110,112 @@ def channelcount_info_box(count, channel_type):
     return grid
 
 
+def _row_key(c):
+    # everything a row shows: the channel itself and the age of its last forward
+    return tuple(getattr(c, name) for name in Channel.__slots__) + (
+        _since(c.last_forward) if c.last_forward else None,
+    )
+
+
+def _trend_cells(c, trend):
+    flow, drift, last_fee_rate = trend or (None, None, None)
+    if last_fee_rate is None or last_fee_rate == c.local_fee_rate:
+        fee_change = "-"
+    else:
+        fee_change = f"{last_fee_rate} → {c.local_fee_rate}"
+    return [
+        f"{flow:+,}" if flow is not None else "-",
+        f"{drift:+,}" if drift is not None else "-",
+        fee_change,
+    ]
+
+
+def _channel_row(
+    c,
+    terminal_web,
+    show_remote_fees,
+    show_chan_ids,
+    show_forwarding_stats,
+    show_minmax_htlc,
+    show_disabled,
+    trends=None,
+):
+    send = int(round(10 * c.local_balance / (c.capacity - c.commit_fee)))
+    recv = 10 - send
+    bar = (
+        "[bright_red]"
+        + ("·" * recv)
+        + "[/bright_red]"
+        + "|"
+        + "[green]"
+        + ("·" * send)
+        + "[/green]"
+    )
+    if c.uptime is not None and c.lifetime:
+        uptime = 100 * c.uptime // c.lifetime
+    else:
+        uptime = "n/a"
+    columns = [
+        f"{c.remote_balance:,}",
+        bar,
+        f"{c.local_balance:,}",
+    ]
+    if show_disabled:
+        columns += [
+            _resolve_disabled(c),
+        ]
+    if show_minmax_htlc:
+        columns += [
+            _resolve_htlc(c.local_min_htlc),
+            _resolve_htlc(c.local_max_htlc),
+            _resolve_htlc(c.remote_min_htlc),
+            _resolve_htlc(c.remote_max_htlc),
+        ]
+    columns += [
+        str(c.local_base_fee) if c.local_base_fee is not None else "-",
+        str(c.local_fee_rate) if c.local_fee_rate is not None else "-",
+        str(c.remote_base_fee) if c.remote_base_fee is not None else "-",
+        str(c.remote_fee_rate) if c.remote_fee_rate is not None else "-",
+        (
+            f"[green]{uptime}[/green]"
+            if c.active
+            else f"[bright_red]{uptime}[/bright_red]"
+        ),
+        _since(c.last_forward) if c.last_forward else "never",
+        f"{round(c.local_fees_msat / 1000):,}" if c.local_fees_msat else "-",
+    ]
+    if show_forwarding_stats:
+        columns += [
+            f"{c.ins}",
+            f"{c.ins_percent:.0%}",
+            f"{c.outs}",
+            f"{c.outs_percent:.0%}",
+        ]
+    if show_remote_fees:
+        columns += [
+            f"{c.remote_fees:,}" if c.remote_fees else "-",
+        ]
+    if terminal_web.show_good_peers:
+        columns += [
+            _resolve_good_peer(c, terminal_web),
+        ]
+    if terminal_web.show_scores:
+        s = terminal_web.get_score(c.remote_node_id)
+        columns += [
+            f"{s:,}" if s is not None else "-",
+        ]
+    if trends is not None:
+        columns += _trend_cells(c, trends.get(c.chan_id))
+    alias_color = "bright_blue" if c.opener == "local" else "bright_yellow"
+    alias = c.remote_alias if c.remote_alias else c.remote_node_id[:16]
+    columns += [
+        f"[{alias_color}]{markup.escape(alias)}[/{alias_color}]",
+    ]
+    if show_chan_ids:
+        columns += [c.chan_id]
+    return columns
+
+
 def channel_table(
     channels,
     terminal_web,
@@ -73,6 +224,10 @@ def channel_table(
     show_forwarding_stats,
     show_minmax_htlc,
     show_disabled,
+    sort_by="ratio",
+    top=None,
+    trends=None,
+    row_cache=None,
 ):
     table = Table(box=box.SIMPLE)
     table.add_column("\ninbound", justify="right", style="bright_red")
@@ -107,6 +262,12 @@ def channel_table(
         table.add_column("good\npeer\n(in|out)", justify="right")
     if terminal_web.show_scores:
         table.add_column("\nscore", justify="right")
+    if trends is not None:
+        table.add_column("net\nflow\n(sat/day)", justify="right")
+        table.add_column("\ndrift 7d\n(sat)", justify="right")
+        table.add_column(
+            "fee_rate\nsince last\nrun (ppm)", justify="right", no_wrap=True
+        )
     table.add_column("\nalias", max_width=25, no_wrap=True)
     if show_chan_ids:
         table.add_column("\nchan_id")
@@ -116,22 +277,8 @@ def channel_table(
     local_base_fees, local_fee_rates = [], []
     remote_base_fees, remote_fee_rates = [], []
 
-    for c in sorted(channels, key=_sort_channels):
-        send = int(round(10 * c.local_balance / (c.capacity - c.commit_fee)))
-        recv = 10 - send
-        bar = (
-            "[bright_red]"
-            + ("·" * recv)
-            + "[/bright_red]"
-            + "|"
-            + "[green]"
-            + ("·" * send)
-            + "[/green]"
-        )
-        if c.uptime is not None and c.lifetime:
-            uptime = 100 * c.uptime // c.lifetime
-        else:
-            uptime = "n/a"
+    # the totals are over all channels, only the shown rows get formatted
+    for c in channels:
         total_fees_local += c.local_fees_msat
         total_fees_remote += c.remote_fees
         total_local += c.local_balance
@@ -144,62 +291,30 @@ def channel_table(
             remote_base_fees.append(c.remote_base_fee)
         if c.remote_fee_rate is not None:
             remote_fee_rates.append(c.remote_fee_rate)
-        columns = [
-            f"{c.remote_balance:,}",
-            bar,
-            f"{c.local_balance:,}",
-        ]
-        if show_disabled:
-            columns += [
-                _resolve_disabled(c),
-            ]
-        if show_minmax_htlc:
-            columns += [
-                _resolve_htlc(c.local_min_htlc),
-                _resolve_htlc(c.local_max_htlc),
-                _resolve_htlc(c.remote_min_htlc),
-                _resolve_htlc(c.remote_max_htlc),
-            ]
-        columns += [
-            str(c.local_base_fee) if c.local_base_fee is not None else "-",
-            str(c.local_fee_rate) if c.local_fee_rate is not None else "-",
-            str(c.remote_base_fee) if c.remote_base_fee is not None else "-",
-            str(c.remote_fee_rate) if c.remote_fee_rate is not None else "-",
-            f"[green]{uptime}[/green]"
-            if c.active
-            else f"[bright_red]{uptime}[/bright_red]",
-            _since(c.last_forward) if c.last_forward else "never",
-            f"{round(c.local_fees_msat / 1000):,}"
-            if c.local_fees_msat
-            else "-",
-        ]
-        if show_forwarding_stats:
-            columns += [
-                f"{c.ins}",
-                f"{c.ins_percent:.0%}",
-                f"{c.outs}",
-                f"{c.outs_percent:.0%}",
-            ]
-        if show_remote_fees:
-            columns += [
-                f"{c.remote_fees:,}" if c.remote_fees else "-",
-            ]
-        if terminal_web.show_good_peers:
-            columns += [
-                _resolve_good_peer(c, terminal_web),
-            ]
-        if terminal_web.show_scores:
-            s = terminal_web.get_score(c.remote_node_id)
-            columns += [
-                f"{s:,}" if s is not None else "-",
-            ]
-        alias_color = "bright_blue" if c.opener == "local" else "bright_yellow"
-        alias = c.remote_alias if c.remote_alias else c.remote_node_id[:16]
-        columns += [
-            f"[{alias_color}]{markup.escape(alias)}[/{alias_color}]",
-        ]
-        if show_chan_ids:
-            columns += [c.chan_id]
+
+    rows = sort_channels(channels, sort_by, top)
+    if len(rows) < len(channels):
+        table.caption = f"top {len(rows):,} of {len(channels):,} channels by {sort_by}"
+    for c in rows:
+        row_args = (
+            c,
+            terminal_web,
+            show_remote_fees,
+            show_chan_ids,
+            show_forwarding_stats,
+            show_minmax_htlc,
+            show_disabled,
+            trends,
+        )
+        if row_cache is None:
+            columns = _channel_row(*row_args)
+        else:
+            # only format the rows whose channel changed since the last call
+            key = _row_key(c) + (trends.get(c.chan_id) if trends else None,)
+            cached = row_cache.get(c.chan_id)
+            if cached is None or cached[0] != key:
+                cached = row_cache[c.chan_id] = key, _channel_row(*row_args)
+            columns = cached[1]
         table.add_row(*columns)
 
     columns = [
@@ -263,15 +378,410 @@ def channel_table(
     return table
 
 
-@click.command()
+def fast_channel_table(
+    channels,
+    terminal_web,
+    show_remote_fees,
+    show_chan_ids,
+    show_forwarding_stats,
+    show_minmax_htlc,
+    show_disabled,
+    sort_by="ratio",
+    top=None,
+    trends=None,
+):
+    """
+    yields the lines of the channel table without rich: every column width
+    follows from the range of its values, so nothing is measured and each
+    row is formatted once, when it is asked for
+    """
+    now = time.time()
+    totals = Totals()
+    for c in channels:
+        totals.add(c)
+    totals = totals.record()
+    columns = []
+
+    def column(header, samples, cell, justify=">", total=None):
+        width = max(
+            [len(line) for line in header.split("\n")]
+            + [len(s) for s in samples]
+            + [len(total or ""), 1]
+        )
+        columns.append((header.split("\n"), width, justify, cell, total))
+
+    def amounts(values, fmt="{:,}"):
+        # the longest amount is the smallest or the largest one
+        values = [v for v in values if v is not None]
+        return [fmt.format(min(values)), fmt.format(max(values))] if values else []
+
+    def optional(value):
+        return str(value) if value is not None else "-"
+
+    def htlc_samples(name):
+        # whole sats with up to three decimals
+        return [
+            s + ".000"
+            for s in amounts(
+                getattr(c, name) // 1000
+                for c in channels
+                if getattr(c, name) is not None
+            )
+        ]
+
+    def bar(c):
+        send = int(round(10 * c.local_balance / (c.capacity - c.commit_fee)))
+        return "·" * (10 - send) + "|" + "·" * send
+
+    def disabled(value):
+        return "y" if value else "n" if value is not None else "-"
+
+    def uptime(c):
+        if c.uptime is not None and c.lifetime:
+            return str(100 * c.uptime // c.lifetime)
+        return "n/a"
+
+    def last_forward(c):
+        return f"{(now - c.last_forward) / 86400:.1f}" if c.last_forward else "never"
+
+    column(
+        "\ninbound",
+        amounts(c.remote_balance for c in channels),
+        lambda c: f"{c.remote_balance:,}",
+        total=f"{totals['remote_balance']:,}",
+    )
+    column("\nratio", ["·" * 10 + "|"], bar, "^")
+    column(
+        "\noutbound",
+        amounts(c.local_balance for c in channels),
+        lambda c: f"{c.local_balance:,}",
+        total=f"{totals['local_balance']:,}",
+    )
+    if show_disabled:
+        column(
+            "is\ndisabled",
+            ["-|-"],
+            lambda c: disabled(c.local_disabled) + "|" + disabled(c.remote_disabled),
+        )
+    if show_minmax_htlc:
+        for header, name in (
+            ("local\nmin_htlc\n(sat)", "local_min_htlc"),
+            ("local\nmax_htlc\n(sat)", "local_max_htlc"),
+            ("remote\nmin_htlc\n(sat)", "remote_min_htlc"),
+            ("remote\nmax_htlc\n(sat)", "remote_max_htlc"),
+        ):
+            column(
+                header,
+                htlc_samples(name),
+                lambda c, name=name: _resolve_htlc(getattr(c, name)),
+            )
+    for header, name in (
+        ("local\nbase_fee\n(msat)", "local_base_fee"),
+        ("local\nfee_rate\n(ppm)", "local_fee_rate"),
+        ("remote\nbase_fee\n(msat)", "remote_base_fee"),
+        ("remote\nfee_rate\n(ppm)", "remote_fee_rate"),
+    ):
+        column(
+            header,
+            amounts((getattr(c, name) for c in channels), "{}"),
+            lambda c, name=name: optional(getattr(c, name)),
+            total=optional(totals[name]),
+        )
+    column("\nuptime\n(%)", ["100", "n/a"], uptime)
+    ages = [now - c.last_forward for c in channels if c.last_forward]
+    column(
+        "last\nforward\n(days)",
+        [f"{max(ages) / 86400:.1f}"] if ages else [],
+        last_forward,
+    )
+    column(
+        "local\nfees\n(sat)",
+        amounts(round(c.local_fees_msat / 1000) for c in channels),
+        lambda c: f"{round(c.local_fees_msat / 1000):,}" if c.local_fees_msat else "-",
+        total=f"{round(totals['local_fees_msat'] / 1000):,}",
+    )
+    if show_forwarding_stats:
+        column("\nfwd in", amounts(c.ins for c in channels), lambda c: f"{c.ins}")
+        column("\nin %", ["100%"], lambda c: f"{c.ins_percent:.0%}")
+        column("\nfwd out", amounts(c.outs for c in channels), lambda c: f"{c.outs}")
+        column("\nout %", ["100%"], lambda c: f"{c.outs_percent:.0%}")
+    if show_remote_fees:
+        column(
+            "remote\nfees\n(sat)",
+            amounts(c.remote_fees for c in channels),
+            lambda c: f"{c.remote_fees:,}" if c.remote_fees else "-",
+            total=f"{totals['remote_fees']:,}",
+        )
+    if terminal_web.show_good_peers:
+        column(
+            "good\npeer\n(in|out)",
+            ["y|n"],
+            lambda c: (
+                ("y" if terminal_web.is_good_inbound_peer(c.remote_node_id) else "n")
+                + "|"
+                + ("y" if terminal_web.is_good_outbound_peer(c.remote_node_id) else "n")
+            ),
+        )
+    if terminal_web.show_scores:
+        column(
+            "\nscore",
+            amounts(terminal_web.get_score(c.remote_node_id) for c in channels),
+            lambda c: optional(terminal_web.get_score(c.remote_node_id)),
+        )
+    if trends is not None:
+        known = [t for t in map(trends.get, (c.chan_id for c in channels)) if t]
+        for i, header in enumerate(("net\nflow\n(sat/day)", "\ndrift 7d\n(sat)")):
+            column(
+                header,
+                amounts((t[i] for t in known), "{:+,}"),
+                lambda c, i=i: _trend_cells(c, trends.get(c.chan_id))[i],
+            )
+        widest_rate = max(
+            amounts((t[2] for t in known), "{}")
+            + amounts((c.local_fee_rate for c in channels), "{}")
+            + [""],
+            key=len,
+        )
+        column(
+            "fee_rate\nsince last\nrun (ppm)",
+            [f"{widest_rate} → {widest_rate}"],
+            lambda c: _trend_cells(c, trends.get(c.chan_id))[2],
+        )
+    alias_width = max([len(c.remote_alias or "") for c in channels] + [16])
+
+    def alias(c):
+        alias = c.remote_alias if c.remote_alias else c.remote_node_id[:16]
+        return alias if len(alias) <= 25 else alias[:24] + "…"
+
+    column("\nalias", ["x" * min(alias_width, 25)], alias, "<")
+    if show_chan_ids:
+        column(
+            "\nchan_id",
+            # channels waiting to confirm have none yet, blank like in rich
+            [max((c.chan_id or "" for c in channels), key=len)],
+            lambda c: c.chan_id or "",
+            "<",
+        )
+
+    def line(cells):
+        return (
+            " "
+            + "  ".join(
+                f"{cell:{justify}{width}}"
+                for cell, (_, width, justify, _, _) in zip(cells, columns)
+            ).rstrip()
+        )
+
+    # headers are aligned at the bottom, like rich does
+    height = max(len(header) for header, *_ in columns)
+    for i in range(height - 1, -1, -1):
+        yield line(header[-1 - i] if i < len(header) else "" for header, *_ in columns)
+    yield " " + "─" * (sum(width + 2 for _, width, *_ in columns) - 2)
+    rows = sort_channels(channels, sort_by, top)
+    for c in rows:
+        yield line(cell(c) for _, _, _, cell, _ in columns)
+    yield line("─" * width if total else "" for _, width, _, _, total in columns)
+    yield line(total or "" for *_, total in columns)
+    if len(rows) < len(channels):
+        yield f" top {len(rows):,} of {len(channels):,} channels by {sort_by}"
+
+
+def fee_update_table(updates):
+    table = Table(box=box.SIMPLE)
+    table.add_column("\nbase_fee\n(msat)", justify="right", style="bright_blue")
+    table.add_column("\nfee_rate\n(ppm)", justify="right", style="bright_blue")
+    # c-lightning's setchannel leaves the delta alone, so it is never known
+    time_lock = any(c.local_time_lock_delta is not None for c, *_ in updates)
+    if time_lock:
+        table.add_column("time\nlock\ndelta", justify="right", style="bright_blue")
+    table.add_column("\nalias", max_width=25, no_wrap=True)
+    table.add_column("\nchan_id")
+
+    def change(old, new):
+        old = str(old) if old is not None else "-"
+        return f"{old} → {new}" if old != str(new) else old
+
+    for c, base_fee, fee_rate, time_lock_delta in updates:
+        alias = c.remote_alias if c.remote_alias else c.remote_node_id[:16]
+        row = [
+            change(c.local_base_fee, base_fee),
+            change(c.local_fee_rate, FeePolicy.ppm(fee_rate)),
+        ]
+        if time_lock:
+            row.append(change(c.local_time_lock_delta, time_lock_delta))
+        table.add_row(*row, markup.escape(alias), c.chan_id)
+    return table
+
+
+def profile_tables(report):
+    phases = Table(box=box.SIMPLE)
+    phases.add_column("\nphase")
+    phases.add_column("\n(s)", justify="right")
+    phases.add_column("\n(%)", justify="right")
+    total = report["total"]
+    rows = list(report["phases"].items())
+    rows.append(("other", max(0.0, total - sum(report["phases"].values()))))
+    for name, seconds in rows:
+        phases.add_row(name, f"{seconds:.3f}", f"{100 * seconds / total:.1f}")
+    phases.add_row("total", f"{total:.3f}", "100.0", style="bold")
+
+    rpcs = Table(box=box.SIMPLE)
+    rpcs.add_column("\nmethod")
+    rpcs.add_column("\ncalls", justify="right")
+    rpcs.add_column("\ntotal\n(s)", justify="right")
+    rpcs.add_column("\np50\n(ms)", justify="right")
+    rpcs.add_column("\np99\n(ms)", justify="right")
+    rpcs.add_column("\nresponses\n(kB)", justify="right")
+    rpcs.add_column("json\ndecode\n(s)", justify="right")
+
+    def ms(seconds):
+        return f"{1000 * seconds:.1f}" if seconds is not None else "-"
+
+    for r in report["rpcs"]:
+        rpcs.add_row(
+            r["method"],
+            f"{r['calls']:,}",
+            f"{r['seconds']:.3f}",
+            ms(r["p50"]),
+            ms(r["p99"]),
+            f"{r['response_bytes'] / 1000:,.1f}",
+            f"{r['decode_seconds']:.3f}",
+        )
+    return [phases, rpcs]
+
+
+def select_channels(ln, channels):
+    if channels == "public":
+        return [c for c in ln.channels.values() if not c.private]
+    elif channels == "private":
+        return [c for c in ln.channels.values() if c.private]
+    else:  # all (and split, which is all of them in two tables)
+        return list(ln.channels.values())
+
+
+def channels_view(ln, terminal_web, channels, table_options, row_cache=None):
+    view = ["", info_box(ln, terminal_web)]
+
+    if channels == "split":
+        public_channels = [c for c in ln.channels.values() if not c.private]
+        private_channels = [c for c in ln.channels.values() if c.private]
+
+        if len(public_channels) > 0:
+            view += [
+                channel_table(
+                    public_channels, terminal_web, **table_options, row_cache=row_cache
+                ),
+                channelcount_info_box(len(public_channels), "public"),
+            ]
+
+        if len(private_channels) > 0:
+            view += [
+                channel_table(
+                    private_channels, terminal_web, **table_options, row_cache=row_cache
+                ),
+                channelcount_info_box(len(private_channels), "private"),
+            ]
+        view += [""]
+
+    else:
+        show_channels = select_channels(ln, channels)
+        if len(show_channels) > 0:
+            view += [
+                channel_table(
+                    show_channels, terminal_web, **table_options, row_cache=row_cache
+                )
+            ]
+
+    return view
+
+
+def stream_warnings(ln):
+    # an event stream that is down leaves the table stale, say so below it
+    return [
+        f"[red]{name} down: {markup.escape(error)}[/red]"
+        for name, error in sorted(ln.stream_errors.items())
+    ]
+
+
+def channels_lines(ln, terminal_web, channels, table_options):
+    """
+    the plain text counterpart of channels_view, produced line by line
+    """
+    yield ""
+    yield f"pubkey    : {ln.local_pubkey}"
+    yield f"alias     : {ln.local_alias}"
+    yield f"channels  : {len(ln.channels):,}"
+    if terminal_web.show_scores:
+        score = terminal_web.get_score(ln.local_pubkey)
+        yield f"score     : {score:,}" if score is not None else "score     : -"
+
+    if channels == "split":
+        for channel_type, private in (("public", False), ("private", True)):
+            selected = [c for c in ln.channels.values() if bool(c.private) == private]
+            if len(selected) > 0:
+                yield ""
+                yield from fast_channel_table(selected, terminal_web, **table_options)
+                yield ""
+                yield f"{channel_type} channels : {len(selected)}"
+        yield ""
+
+    else:
+        show_channels = select_channels(ln, channels)
+        if len(show_channels) > 0:
+            yield ""
+            yield from fast_channel_table(show_channels, terminal_web, **table_options)
+
+
+def page(lines, console):
+    """
+    shows the lines a screen at a time; they are only produced (and so the
+    rows only formatted) once their screen comes up
+    """
+    lines = iter(lines)
+    if not console.is_terminal:
+        sys.stdout.writelines(line + "\n" for line in lines)
+        return
+    height = max(console.size.height - 1, 2)
+    pending = []
+    while True:
+        for line in itertools.chain(
+            pending, itertools.islice(lines, height - len(pending))
+        ):
+            click.echo(line)
+        # one line ahead, so there is no prompt after the last screen
+        pending = list(itertools.islice(lines, 1))
+        if not pending:
+            return
+        click.echo("-- more -- (q to quit)", nl=False)
+        key = click.getchar()
+        click.echo("\r\033[K", nl=False)
+        if key in ("q", "Q", "\x1b", "\x03"):
+            return
+
+
+@click.group(invoke_without_command=True)
 @click.option("--base-fee", default=0, help="Set base fee.")
 @click.option("--fee-rate", default=0, help="Set fee rate.")
 @click.option("--fee-spread", default=0.0, help="Fee spread.")
 @click.option("--time-lock-delta", default=40, help="Set time lock delta.")
+@click.option(
+    "--fee-tolerance",
+    default=0,
+    help="Do not update channels whose fee rate is off by at most this (ppm).",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Only print the fee changes that would be made."
+)
+@click.option(
+    "--verify", is_flag=True, help="Re-read updated channels after setting fees."
+)
 @click.option(
     "--client",
     default="lnd",
-    type=click.Choice(("lnd", "c-lightning", "lnd-rest"), case_sensitive=False),
+    type=click.Choice(
+        ("lnd", "c-lightning", "c-lightning-socket", "lnd-rest", "lnd-grpc"),
+        case_sensitive=False,
+    ),
     help="Type of LN client.",
 )
 @click.option(
@@ -297,17 +807,133 @@ def channel_table(
 )
 @click.option("--show-minmax-htlc", is_flag=True, help="Show min and max htlc.")
 @click.option("--show-disabled", is_flag=True, help="Show if channel is disabled.")
+@click.option(
+    "--bulk-graph",
+    is_flag=True,
+    help="Fetch channel graph in bulk instead of per channel.",
+)
+@click.option(
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of per-channel lookups to run in parallel.",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Cache aliases, channel policies and node scores between runs.",
+)
+@click.option(
+    "--refresh-cache", is_flag=True, help="Ignore cached entries and refetch them."
+)
+@click.option(
+    "--fwd-store",
+    is_flag=True,
+    help="Keep forwarding history in a local store and fetch only new events "
+    "(c-lightning otherwise reads its whole history on every run).",
+)
+@click.option(
+    "--fwd-days",
+    default=30,
+    help="Number of days of forwarding history to take into account.",
+)
+@click.option(
+    "--watch",
+    type=float,
+    metavar="INTERVAL",
+    help="Keep running and refresh the table every INTERVAL seconds.",
+)
+@click.option(
+    "--events",
+    is_flag=True,
+    help="With --watch, follow lnd's event streams instead of polling "
+    "(lnd-rest and lnd-grpc only).",
+)
+@click.option(
+    "--output",
+    "output_format",
+    default="table",
+    type=click.Choice(("table",) + FORMATS, case_sensitive=False),
+    help="Print a table or stream raw channel records as JSON, NDJSON or CSV.",
+)
+@click.option(
+    "--top",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Only show the first N channels of the table (totals still cover all).",
+)
+@click.option(
+    "--sort-by",
+    default="ratio",
+    type=click.Choice(tuple(SORT_KEYS), case_sensitive=False),
+    help="Order of the table (ratio: most inbound liquidity first, "
+    "alias: alphabetical, the others largest or most recent first).",
+)
+@click.option(
+    "--renderer",
+    default="rich",
+    type=click.Choice(("rich", "fast"), case_sensitive=False),
+    help="Render the table with rich, or as plain fixed-width text that "
+    "prints thousands of channels without measuring them.",
+)
+@click.option(
+    "--pager",
+    is_flag=True,
+    help="Page through the (fast) table, formatting rows as they are shown.",
+)
+@click.option(
+    "--record",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Save every response of the node to a compressed snapshot FILE "
+    "(bypasses the cache and the forwarding store).",
+)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Answer from a snapshot FILE made with --record instead of a node; "
+    "fee updates are accepted but go nowhere.",
+)
+@click.option(
+    "--history",
+    "keep_history",
+    is_flag=True,
+    help="Keep the balances and fees of every run in a local history store.",
+)
+@click.option(
+    "--show-trends",
+    is_flag=True,
+    help="Show net flow per day, 7 day balance drift and fee rate changes "
+    "since the last run, from the history store.",
+)
+@click.option(
+    "--profile",
+    "report_profile",
+    is_flag=True,
+    help="At exit, print where the time went (per phase and per RPC method) "
+    "to stderr.",
+)
+@click.option(
+    "--profile-format",
+    default="table",
+    type=click.Choice(("table", "json"), case_sensitive=False),
+    help="Print the --profile report as a table or as JSON.",
+)
 @click.option(
     "--channels",
     default="all",
     type=click.Choice(("all", "public", "private", "split"), case_sensitive=False),
     help="Which channels to select/show.",
 )
+@click.pass_context
 def suez(
+    ctx,
     base_fee,
     fee_rate,
     fee_spread,
     time_lock_delta,
+    fee_tolerance,
+    dry_run,
+    verify,
     client,
     client_args,
     show_remote_fees,
@@ -317,82 +943,298 @@ def suez(
     show_forwarding_stats,
     show_minmax_htlc,
     show_disabled,
+    bulk_graph,
+    jobs,
+    cache,
+    refresh_cache,
+    fwd_store,
+    fwd_days,
+    watch,
+    events,
+    output_format,
+    top,
+    sort_by,
+    renderer,
+    pager,
+    record,
+    replay,
+    keep_history,
+    show_trends,
+    report_profile,
+    profile_format,
     channels,
 ):
     clients = {
         "lnd": LndCliClient,
         "c-lightning": ClnClient,
+        "c-lightning-socket": ClnSocketClient,
         "lnd-rest": LndRestClient,
+        "lnd-grpc": LndGrpcClient,
     }
 
-    ln = clients[client](client_args)
+    if watch and output_format != "table":
+        raise click.UsageError("--watch only works with --output table")
+    if watch and (renderer == "fast" or pager):
+        raise click.UsageError("--watch only works with the rich renderer")
+    if record and replay:
+        raise click.UsageError("--record and --replay do not go together")
+    if events and replay:
+        raise click.UsageError("a snapshot has no events to follow")
+    if keep_history and replay:
+        raise click.UsageError("a snapshot is not kept in the history")
+    if events and (not watch or client not in ("lnd-rest", "lnd-grpc")):
+        raise click.UsageError(
+            "--events needs --watch and an lnd-rest or lnd-grpc client"
+        )
+
+    # a snapshot has to hold every response a run needs, so nothing may come
+    # from the cache or the forwarding store instead
+    recorder = None
+    if record:
+        recorder = Recorder("cln" if client.startswith("c-lightning") else "lnd")
+        ctx.call_on_close(lambda: recorder.save(record))
+
+    def connect():
+        ln = open_client()
+        ctx.call_on_close(ln.close)
+        return ln
+
+    def open_client():
+        if replay:
+            return replay_client(
+                replay, bulk_graph=bulk_graph, jobs=jobs, fwd_days=fwd_days
+            )
+        return clients[client](
+            client_args,
+            bulk_graph=bulk_graph,
+            jobs=jobs,
+            # fee updates are planned against our own policies, which may
+            # have been changed outside suez since they were cached
+            cache=(
+                Cache(
+                    client,
+                    refresh=refresh_cache,
+                    bypass=("chaninfo",) if fee_rate else (),
+                )
+                if cache and not record
+                else None
+            ),
+            fwd_store=ForwardStore(client) if fwd_store and not record else None,
+            fwd_days=fwd_days,
+            recorder=recorder,
+        )
+
+    if ctx.invoked_subcommand is not None:
+        # subcommands connect themselves (after their own options are parsed)
+        # and share the fee options
+        ctx.obj = dict(
+            connect=connect,
+            policy=(
+                FeePolicy(base_fee, fee_rate, fee_spread, time_lock_delta)
+                if fee_rate
+                else None
+            ),
+            fee_tolerance=fee_tolerance,
+            dry_run=dry_run,
+        )
+        return
+
+    profile = Profile()
+    ln = None
+    if report_profile:
 
-    if len(ln.channels) == 0:
+        def print_profile():
+            report = profile.report(ln.rpc_stats if ln is not None else None)
+            if profile_format == "json":
+                click.echo(json.dumps(report), err=True)
+            else:
+                Console(stderr=True).print(*profile_tables(report))
+
+        ctx.call_on_close(print_profile)
+
+    # the scores download runs in the background while the node is queried
+    summary = (
+        TerminalWeb.prefetch(cache, refresh_cache)
+        if show_scores or show_good_peers
+        else None
+    )
+    with profile.phase("refresh"):
+        ln = connect()
+
+    if len(ln.channels) == 0 and output_format == "table":
         click.echo("No channels found. Exiting")
         return
 
-    terminal_web = TerminalWeb(ln.local_pubkey, show_scores, show_good_peers)
+    # only what is left of the download once the node is refreshed, and parsing
+    with profile.phase("terminal"):
+        terminal_web = TerminalWeb(
+            ln.local_pubkey,
+            show_scores,
+            show_good_peers,
+            peers=[c.remote_node_id for c in ln.channels.values()],
+            summary=summary,
+        )
+
+    console = Console()
 
     if fee_rate:
         policy = FeePolicy(base_fee, fee_rate, fee_spread, time_lock_delta)
-        ln.apply_fee_policy(policy)
-        ln.refresh()
+        if dry_run:
+            with profile.phase("fees"):
+                updates = ln.plan_fee_policy(policy, fee_tolerance)
+            console.print()
+            if updates:
+                console.print(fee_update_table(updates))
+            console.print(f"{len(updates)} of {len(ln.channels)} channels would change")
+            return
+        with profile.phase("fees"):
+            updates = ln.apply_fee_policy(policy, fee_tolerance)
+            if verify:
+                ln.verify_fees(updates)
 
-    info = info_box(ln, terminal_web)
+    # trends are taken before this run is added, so that the fee rate change
+    # is against the previous run
+    history = HistoryStore(client) if keep_history or show_trends else None
 
-    console = Console()
-    console.print()
-    console.print(info)
+    def track():
+        trends = (
+            history.trends(ln.local_pubkey, ln.channels.values())
+            if show_trends
+            else None
+        )
+        if keep_history:
+            history.add(ln.local_pubkey, ln.channels.values())
+        return trends
 
-    if channels == "split":
-        public_channels = [c for c in ln.channels.values() if not c.private]
-        private_channels = [c for c in ln.channels.values() if c.private]
+    trends = None
+    if history is not None:
+        with profile.phase("history"):
+            trends = track()
 
-        if len(public_channels) > 0:
-            public_table = channel_table(
-                public_channels,
-                terminal_web,
-                show_remote_fees,
-                show_chan_ids,
-                show_forwarding_stats,
-                show_minmax_htlc,
-                show_disabled,
+    if output_format != "table":
+        with profile.phase("render"):
+            write_channels(
+                select_channels(ln, channels), terminal_web, output_format, sys.stdout
             )
-            public_info = channelcount_info_box(len(public_channels), "public")
-            console.print(public_table)
-            console.print(public_info)
+        return
 
-        if len(private_channels) > 0:
-            private_table = channel_table(
-                private_channels,
-                terminal_web,
-                show_remote_fees,
-                show_chan_ids,
-                show_forwarding_stats,
-                show_minmax_htlc,
-                show_disabled,
-            )
-            private_info = channelcount_info_box(len(private_channels), "private")
-            console.print(private_table)
-            console.print(private_info)
-        console.print()
+    table_options = dict(
+        show_remote_fees=show_remote_fees,
+        show_chan_ids=show_chan_ids,
+        show_forwarding_stats=show_forwarding_stats,
+        show_minmax_htlc=show_minmax_htlc,
+        show_disabled=show_disabled,
+        sort_by=sort_by,
+        top=top,
+        trends=trends,
+    )
 
-    else:
-        if channels == "public":
-            show_channels = [c for c in ln.channels.values() if not c.private]
-        elif channels == "private":
-            show_channels = [c for c in ln.channels.values() if c.private]
-        else:  # all
-            show_channels = ln.channels.values()
+    if renderer == "fast" or pager:
+        with profile.phase("render"):
+            lines = channels_lines(ln, terminal_web, channels, table_options)
+            if pager:
+                page(lines, console)
+            else:
+                sys.stdout.writelines(line + "\n" for line in lines)
+        return
 
-        if len(show_channels) > 0:
-            table = channel_table(
-                show_channels,
-                terminal_web,
-                show_remote_fees,
-                show_chan_ids,
-                show_forwarding_stats,
-                show_minmax_htlc,
-                show_disabled,
-            )
-            console.print(table)
+    if not watch:
+        with profile.phase("render"):
+            for renderable in channels_view(ln, terminal_web, channels, table_options):
+                console.print(renderable)
+        return
+
+    # keep the client (and its connections and caches) between refreshes and
+    # only reformat the rows of channels that changed
+    row_cache = {}
+    with profile.phase("render"):
+        view = channels_view(ln, terminal_web, channels, table_options, row_cache)
+    if events:
+        # the channels are updated in the background, redraw on the timer
+        ln.subscribe()
+    with Live(Group(*view), console=console, auto_refresh=False) as live:
+        try:
+            while True:
+                time.sleep(watch)
+                if not events:
+                    with profile.phase("refresh"):
+                        ln.refresh()
+                with profile.phase("render"):
+                    with ln.lock if events else contextlib.nullcontext():
+                        if history is not None:
+                            table_options["trends"] = track()
+                        view = channels_view(
+                            ln, terminal_web, channels, table_options, row_cache
+                        ) + (stream_warnings(ln) if events else [])
+                    live.update(Group(*view), refresh=True)
+        except KeyboardInterrupt:
+            pass
+
+
+@suez.command()
+@click.option(
+    "--interval", default=600.0, help="Seconds between fee policy evaluations."
+)
+@click.option(
+    "--hysteresis",
+    default=0.1,
+    help="Only update a channel when its fee rate moves by more than this "
+    "fraction of the current rate.",
+)
+@click.option(
+    "--min-interval",
+    default=3600.0,
+    help="Minimum seconds between two updates of the same channel.",
+)
+@click.option(
+    "--max-updates", default=60, help="Maximum number of channel updates per hour."
+)
+@click.pass_obj
+def daemon(obj, interval, hysteresis, min_interval, max_updates):
+    """Keep re-evaluating the fee policy and apply the changes that matter."""
+    if obj["policy"] is None:
+        raise click.UsageError("daemon needs --fee-rate")
+    ln = obj["connect"]()
+    fee_daemon = FeeDaemon(
+        ln, obj["policy"], obj["fee_tolerance"], hysteresis, min_interval, max_updates
+    )
+    console = Console()
+    try:
+        while True:
+            try:
+                updates, deferred = fee_daemon.plan()
+                if updates:
+                    console.print(fee_update_table(updates))
+                if not obj["dry_run"]:
+                    fee_daemon.apply(updates)
+                console.print(
+                    f"{datetime.now():%Y-%m-%d %H:%M:%S} "
+                    f"{'would update' if obj['dry_run'] else 'updated'} "
+                    f"{len(updates)} of {len(ln.channels)} channels, "
+                    f"{deferred} deferred"
+                )
+            except Exception as e:
+                console.print(f"{datetime.now():%Y-%m-%d %H:%M:%S} error: {e}")
+            time.sleep(interval)
+            try:
+                ln.refresh()
+            except Exception as e:
+                console.print(f"{datetime.now():%Y-%m-%d %H:%M:%S} error: {e}")
+    except KeyboardInterrupt:
+        pass
+
+
+@suez.command("serve-metrics")
+@click.option(
+    "--listen",
+    default="127.0.0.1:9109",
+    help="Address (host:port) to serve the metrics on.",
+)
+@click.option("--interval", default=60.0, help="Seconds between node refreshes.")
+@click.pass_obj
+def serve_metrics(obj, listen, interval):
+    """Serve channel metrics in the OpenMetrics format."""
+    try:
+        MetricsExporter(obj["connect"], interval).serve(listen)
+    except KeyboardInterrupt:
+        pass
@@ -1,34 +1,283 @@
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
 import requests
 
+from cache import TTLS, cache_dir
+
+SUMMARY_URL = (
+    "https://ln-scores.prod.lightningcluster.com/availability/v3/btc_summary.json"
+)
+HEADERS = {"referer": "https://terminal.lightning.engineering/"}
+CHUNK_SIZE = 1 << 16
+# what ends a scalar, and what matters when scanning past a nested value
+SCALAR_END = re.compile(r"[\s,\]}]")
+NESTING = re.compile(r'["\[\]{}]')
+STRING_END = re.compile(r'["\\]')
+
 
 class TerminalWeb:
-    def __init__(self, local_pubkey, show_scores, show_good_peers):
+    def __init__(
+        self,
+        local_pubkey,
+        show_scores,
+        show_good_peers,
+        peers=None,
+        cache=True,
+        refresh=False,
+        summary=None,
+    ):
         self.local_pubkey = local_pubkey
         self.show_scores = show_scores
         self.show_good_peers = show_good_peers
+        self.nodes = {}
+        self.local_node = None
+        self.good_inbound_peers = set()
+        self.good_outbound_peers = set()
         if show_scores or show_good_peers:
+            # only our own node and our peers are ever looked up, everything
+            # else in the summary is dropped while it is parsed
+            wanted = None if peers is None else {local_pubkey, *peers}
+            if summary is None:
+                summary = self.prefetch(cache, refresh)
             try:
-                r = requests.get(
-                    "https://ln-scores.prod.lightningcluster.com/availability/v3/btc_summary.json",
-                    headers={"referer": "https://terminal.lightning.engineering/"},
-                )
-                j = r.json()
-                self.nodes = j["scored"]
-                self.local_node = self.nodes.get(local_pubkey)
+                with summary.result() as f:
+                    self.nodes = dict(_scored_nodes(f, wanted))
             except:
                 self.nodes = {}
-                self.local_node = None
+            self.local_node = self.nodes.get(local_pubkey)
+            if self.local_node:
+                self.good_inbound_peers = set(
+                    self.local_node.get("good_inbound_peers") or ()
+                )
+                self.good_outbound_peers = set(
+                    self.local_node.get("good_outbound_peers") or ()
+                )
+
+    @staticmethod
+    def prefetch(cache=True, refresh=False):
+        """
+        starts fetching the summary in a background thread and returns a future
+        of the open file; the download does not depend on the node, so it can
+        run while the node is queried
+        """
+        future = Future()
+
+        def fetch():
+            try:
+                if cache:
+                    f = _fetch_cached(refresh).open(encoding="utf-8")
+                else:
+                    f = _fetch_uncached()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(f)
+
+        threading.Thread(target=fetch, daemon=True).start()
+        return future
 
     def is_good_inbound_peer(self, remote_pubkey):
-        if not self.local_node or "good_inbound_peers" not in self.local_node:
-            return False
-        return remote_pubkey in self.local_node["good_inbound_peers"]
+        return remote_pubkey in self.good_inbound_peers
 
     def is_good_outbound_peer(self, remote_pubkey):
-        if not self.local_node or "good_outbound_peers" not in self.local_node:
-            return False
-        return remote_pubkey in self.local_node["good_outbound_peers"]
+        return remote_pubkey in self.good_outbound_peers
 
     def get_score(self, pubkey):
         node = self.nodes.get(pubkey)
         return node["score"] if node else None
+
+
+def _fetch_uncached():
+    r = requests.get(SUMMARY_URL, headers=HEADERS, stream=True, timeout=60)
+    r.raise_for_status()
+    f = tempfile.TemporaryFile()
+    for chunk in r.iter_content(CHUNK_SIZE):
+        f.write(chunk)
+    f.seek(0)
+    return io.TextIOWrapper(f, encoding="utf-8")
+
+
+def _fetch_cached(refresh=False):
+    # the summary is kept on disk and revalidated with ETag/Last-Modified
+    # once it is older than its TTL; a stale copy is used if that fails
+    path = cache_dir() / "btc_summary.json"
+    meta_path = cache_dir() / "btc_summary.meta"
+    try:
+        meta = json.loads(meta_path.read_text())
+    except:
+        meta = {}
+    if (
+        path.exists()
+        and not refresh
+        and meta.get("fetched_at", 0) > time.time() - TTLS["terminal"]
+    ):
+        return path
+
+    headers = dict(HEADERS)
+    if path.exists():
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        r = requests.get(SUMMARY_URL, headers=headers, stream=True, timeout=60)
+        if r.status_code != 304:
+            r.raise_for_status()
+            cache_dir().mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_dir() / "btc_summary.json.tmp"
+            with tmp_path.open("wb") as f:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+            meta = {
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+            }
+        meta["fetched_at"] = time.time()
+        meta_path.write_text(json.dumps(meta))
+    except:
+        if not path.exists():
+            raise
+    return path
+
+
+def _scored_nodes(f, wanted=None):
+    """
+    yields (pubkey, node) from the "scored" object of the summary in f, one
+    node at a time; nodes whose pubkey is not in wanted are skipped
+    """
+    stream = _JsonStream(f)
+    stream.expect("{")
+    for name in stream.members():
+        if name != "scored":
+            stream.skip()
+            continue
+        stream.expect("{")
+        for pubkey in stream.members():
+            if wanted is None or pubkey in wanted:
+                yield pubkey, stream.decode()
+            else:
+                stream.skip()
+
+
+class _JsonStream:
+    # just enough of an incremental JSON reader to walk the members of an
+    # object; a value is found by scanning its brackets and strings, every
+    # character once, and only decoded when asked for
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.mark = None
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(CHUNK_SIZE)
+        if not chunk:
+            return False
+        # keep the value being decoded, if any, drop everything before it
+        keep = self.pos if self.mark is None else self.mark
+        self.buf = self.buf[keep:] + chunk
+        self.pos -= keep
+        if self.mark is not None:
+            self.mark = 0
+        return True
+
+    def _char(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                self.pos += 1
+                return self.buf[self.pos - 1]
+            if not self._fill():
+                raise ValueError("unexpected end of JSON document")
+
+    def _search(self, pattern, eof_ok=False):
+        while True:
+            m = pattern.search(self.buf, self.pos)
+            if m is not None:
+                return m
+            self.pos = len(self.buf)
+            if not self._fill():
+                if eof_ok:
+                    return None
+                raise ValueError("unexpected end of JSON document")
+
+    def _skip_string(self):
+        # the opening quote was just read
+        while True:
+            m = self._search(STRING_END)
+            if m.group() == '"':
+                self.pos = m.end()
+                return
+            # an escape, whose second character may still be in the next chunk
+            self.pos = m.start()
+            if m.end() < len(self.buf):
+                self.pos = m.end() + 1
+            elif not self._fill():
+                raise ValueError("unexpected end of JSON document")
+
+    def expect(self, char):
+        c = self._char()
+        if c != char:
+            raise ValueError(f"expected {char!r}, got {c!r}")
+
+    def skip(self):
+        """
+        moves past the next value without decoding it
+        """
+        c = self._char()
+        if c == '"':
+            self._skip_string()
+        elif c in "[{":
+            depth = 1
+            while depth:
+                m = self._search(NESTING)
+                self.pos = m.end()
+                if m.group() == '"':
+                    self._skip_string()
+                elif m.group() in "[{":
+                    depth += 1
+                else:
+                    depth -= 1
+        else:
+            m = self._search(SCALAR_END, eof_ok=True)
+            if m is not None:
+                self.pos = m.start()
+
+    def decode(self):
+        self._char()
+        self.pos -= 1
+        self.mark = self.pos
+        try:
+            self.skip()
+        finally:
+            start, self.mark = self.mark, None
+        return self.decoder.decode(self.buf[start : self.pos])
+
+    def members(self):
+        """
+        yields the member names of the object whose "{" was just read, the
+        caller has to consume each value before asking for the next name
+        """
+        if self._char() == "}":
+            return
+        self.pos -= 1
+        while True:
+            name = self.decode()
+            self.expect(":")
+            yield name
+            c = self._char()
+            if c == "}":
+                return
+            if c != ",":
+                raise ValueError(f"expected ',' or '}}', got {c!r}")